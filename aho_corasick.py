@@ -0,0 +1,79 @@
+# Aho-Corasick automaton for scanning many motifs (with IUPAC ambiguity codes) in one pass over a sequence
+
+from collections import deque
+from itertools import product
+
+IUPAC = {
+    "A": "A", "C": "C", "G": "G", "T": "T", "U": "T",
+    "R": "AG", "Y": "CT", "S": "CG", "W": "AT", "K": "GT", "M": "AC",
+    "B": "CGT", "D": "AGT", "H": "ACT", "V": "ACG", "N": "ACGT",
+}
+MAX_EXPANSIONS = 4096                                                 # concrete sequences a single ambiguous motif may expand to
+
+
+def expandIUPAC(motif):
+    # Every concrete A/C/G/T sequence matched by a motif written with IUPAC codes
+    options = []
+    total = 1
+    for char in motif.upper():
+        if char not in IUPAC:
+            raise ValueError(f"Invalid character '{char}' in motif {motif}")
+        options.append(IUPAC[char])
+        total *= len(IUPAC[char])
+    if total > MAX_EXPANSIONS:
+        raise ValueError(f"Motif {motif} is too ambiguous ({total} variants, limit {MAX_EXPANSIONS})")
+    return ["".join(p) for p in product(*options)]
+
+
+def isAmbiguous(motif):
+    return any(char not in "ACGT" for char in motif.upper())
+
+
+class AhoCorasick:
+    def __init__(self, motifs):
+        self._motifs = list(motifs)
+        self._lengths = [len(m) for m in self._motifs]
+        goto = [{}]
+        outputs = [[]]                                                # motif indexes ending at each state
+        for index, motif in enumerate(self._motifs):
+            for pattern in expandIUPAC(motif):
+                state = 0
+                for char in pattern:
+                    if char not in goto[state]:
+                        goto[state][char] = len(goto)
+                        goto.append({})
+                        outputs.append([])
+                    state = goto[state][char]
+                outputs[state].append(index)
+        # Breadth-first pass: failure links, merged outputs and a full transition table (a DFA, no failure walks while scanning)
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            for char, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(char, 0) if state else 0
+                queue.append(child)
+        self._delta = delta
+        self._outputs = outputs
+
+    def scan(self, seq: str):
+        # Per motif: sorted start offsets of every (overlapping) hit
+        hits = [[] for _ in self._motifs]
+        delta = self._delta
+        outputs = self._outputs
+        lengths = self._lengths
+        state = 0
+        for end, char in enumerate(seq.upper()):
+            state = delta[state].get(char, 0)
+            for index in outputs[state]:
+                hits[index].append(end - lengths[index] + 1)
+        for offsets in hits:
+            offsets.sort()
+        return hits
+
+    def count(self, seq: str):
+        return [len(offsets) for offsets in self.scan(seq)]
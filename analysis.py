@@ -1,69 +1,183 @@
-import matplotlib.pyplot as plt
+import os
+import threading
+from functools import partial
 import numpy as np
-from parser import FastaParser
+import pandas as pd
+from parser import FastaParser, FastaIndex, content_hash
 from models import MitochondrialDNA, MotifFinder, SequenceAlignment
+from fm_index_query import CollectionFMIndex
+from similarity import SimilarityEngine
+from aho_corasick import isAmbiguous
+from genome_stats import genomeStats
+from plotting import pyplot
 
 class MitoAnalysisSystem:
-    def __init__(self, fasta_file):
-        parser = FastaParser()
-        self.data = parser.parse(fasta_file, 'fasta')
-        self.genomes = [
-            MitochondrialDNA(seq=row['seq'], ID=row['id'], description=row['description'])
-            for _, row in self.data.iterrows()
-        ]
+    def __init__(self, fasta_file, persist_index=True, lazy=False, packed=False):
+        # lazy=True keeps the sequences on disk and reads each one through the .fai offset index when it is needed,
+        # packed=True keeps them in memory at 2 bits per base
+        self.fasta_file = fasta_file
+        self._content_hash = None
+        self.persist_index = persist_index
+        self.fasta_index = None
+        if lazy:
+            try:
+                self.fasta_index = FastaIndex(fasta_file)
+            except ValueError: # duplicate ids or uneven line wrapping cannot be offset-indexed, load it eagerly instead
+                lazy = False
+        if lazy:
+            self.genomes = [
+                MitochondrialDNA(
+                    seq=None, ID=name, description=self.fasta_index.description(name),
+                    loader=partial(self.fasta_index.fetch, name), length=self.fasta_index.length(name),
+                )
+                for name in self.fasta_index.names()
+            ]
+        else:
+            self.genomes = []
+            for record in FastaParser().stream(fasta_file):
+                genome = MitochondrialDNA(seq=record.seq, ID=record.id, description=record.description)
+                genome.sketch # sketches are cheap, build them up front for similarity ranking
+                self.genomes.append(genome.pack() if packed else genome)
+        # One row per genome, no sequence column
+        self.data = pd.DataFrame({
+            "id": [g.id for g in self.genomes],
+            "description": [g.description for g in self.genomes],
+            "length": [g.get_length() for g in self.genomes],
+        })
+        self._collection_index = None
+        # Background jobs may ask for the index or stats at the same time; one lock each, so a page reading the stats
+        # never waits for an index build
+        self._index_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.similarity_engine = SimilarityEngine(self.genomes)
+        self._stats = None
+        if not lazy: # lazy datasets compute their stats on first use instead of reading everything up front
+            self.stats
+
+    # Derived structures that release() can drop; each is rebuilt (or reloaded from disk) on next use
+    DERIVED = ("collection_index", "genome_indexes", "stats", "similarity")
+
+    def memory_usage(self):
+        # Approximate heap bytes per component: the sequences themselves plus every derived structure
+        return {
+            "sequences": sum(g.nbytes for g in self.genomes),
+            "collection_index": self._collection_index.nbytes if self._collection_index is not None else 0,
+            "genome_indexes": sum(g.index_nbytes for g in self.genomes),
+            "stats": int(self._stats.memory_usage(deep=True).sum()) if self._stats is not None else 0,
+            "similarity": self.similarity_engine.nbytes,
+        }
+
+    def release(self, component):
+        if component not in self.DERIVED:
+            raise ValueError(f"Unknown component {component}")
+        # Plain reference drops, no lock: a build in progress is not waited for, it just lands after the release
+        if component == "collection_index":
+            self._collection_index = None
+        elif component == "genome_indexes":
+            for genome in self.genomes:
+                genome.release_index()
+        elif component == "stats":
+            self._stats = None
+        else:
+            self.similarity_engine.clear()
+
+    @property
+    def stats(self):
+        # Columnar per-genome statistics table, computed once per dataset
+        stats = self._stats
+        if stats is not None:
+            return stats
+        with self._stats_lock:
+            stats = self._stats
+            if stats is None:
+                stats = self._stats = genomeStats(self.genomes)
+        return stats
+
+    @property
+    def content_hash(self):
+        # Hashing reads the whole file, so it only happens once something keyed by it is needed
+        if self._content_hash is None:
+            self._content_hash = content_hash(self.fasta_file)
+        return self._content_hash
+
+    @property
+    def collection_index(self):
+        # Single FM-index over every loaded genome, built on first motif query
+        # With persist_index the index is saved next to the FASTA file, keyed by its content hash, and memory-mapped on reuse
+        index = self._collection_index
+        if index is not None:
+            return index
+        with self._index_lock:
+            index = self._collection_index
+            if index is None:
+                ids = [g.id for g in self.genomes]
+                seqs = [g.seq for g in self.genomes]
+                if self.persist_index:
+                    index = CollectionFMIndex.load_or_build(self.index_path, ids, seqs)
+                else:
+                    index = CollectionFMIndex(ids, seqs)
+                self._collection_index = index
+        return index
+
+    @property
+    def index_path(self):
+        folder = os.path.dirname(os.path.abspath(self.fasta_file))
+        return os.path.join(folder, f".{self.content_hash}.fmindex")
+
+    def motif_count_matrix(self, motifs):
+        # Rows follow motifs, columns follow self.genomes; plain motifs use the FM-index, IUPAC motifs one automaton pass per genome
+        ambiguous = [m for m in motifs if isAmbiguous(m)]
+        plain = [m for m in motifs if not isAmbiguous(m)]
+        rows = dict(zip(plain, self.collection_index.count_matrix(plain)))
+        if ambiguous:
+            rows.update(zip(ambiguous, MotifFinder.count_many(ambiguous, self.genomes)[0]))
+        return [rows[m] for m in motifs]
 
     def compare_two_species(self, idx1=0, idx2=1):
         g1 = self.genomes[idx1]
         g2 = self.genomes[idx2]
         aligner = SequenceAlignment(g1.seq, g2.seq)
-        aligned_seq1, comparison_line, aligned_seq2 = aligner.align_sequences()
-        self.visualize_differences_bar(aligned_seq1, aligned_seq2, g1.id, g2.id)
-        return aligned_seq1, comparison_line, aligned_seq2
+        result = aligner.align(algo="banded")
+        self.visualize_differences_bar(result, g1.id, g2.id)
+        return result.seq1_gapped, result.comparison, result.seq2_gapped
 
-    def visualize_differences_bar(self, seq1, seq2, label1, label2):
-        matches = mismatches = gaps = 0
+    def visualize_differences_bar(self, result, label1, label2):
         block_size = 60
-        length = len(seq1)
+        seq1, comp, seq2 = result.seq1_gapped, result.comparison, result.seq2_gapped
         print(f"\nComparison between {label1} and {label2}:\n")
-        for i in range(0, length, block_size):
-            block1 = seq1[i:i+block_size]
-            block2 = seq2[i:i+block_size]
-            comp_line = ""
-            for a, b in zip(block1, block2):
-                if a == b and a != "-":
-                    comp_line += "*"
-                    matches += 1
-                elif a == '-' or b == '-':
-                    comp_line += " "
-                    gaps += 1
-                else:
-                    comp_line += "|"
-                    mismatches += 1
-            label_width = max(len(label1), len(label2))
-            print(f"{label1.ljust(label_width)}: {block1}")
-            print(f"{' '.ljust(label_width)}  {comp_line}")
-            print(f"{label2.ljust(label_width)}: {block2}\n")
+        label_width = max(len(label1), len(label2))
+        for i in range(0, result.length, block_size):
+            print(f"{label1.ljust(label_width)}: {seq1[i:i+block_size]}")
+            print(f"{' '.ljust(label_width)}  {comp[i:i+block_size]}")
+            print(f"{label2.ljust(label_width)}: {seq2[i:i+block_size]}\n")
         print("Summary:")
-        print(f"  Matches   : {matches}")
-        print(f"  Mismatches: {mismatches}")
-        print(f"  Gaps      : {gaps}")
-        print(f"  Total     : {length} positions")
+        print(f"  Matches   : {result.matches}")
+        print(f"  Mismatches: {result.mismatches}")
+        print(f"  Gaps      : {result.gaps}")
+        print(f"  Total     : {result.length} positions")
 
-    def motif_conservation_heatmap(self, motifs, output_path, threshold_score=4):
-        conservation_matrix = []
+    def motif_conservation_matrix(self, motifs, max_diffs=1, threshold_score=4, indels=False):
+        # 1 where the genome holds the whole motif with at most max_diffs mismatches (edits with indels), one index walk per motif.
+        # This replaced a local alignment score >= threshold_score (match 1, mismatch -1) and stays within it: motifs shorter
+        # than the threshold are never conserved, and a motif of length L is allowed at most (L - threshold_score) // 2
+        # mismatches, so 4-mers match exactly. Unlike the old score it no longer counts partial hits of a longer motif
+        matrix = []
         for motif in motifs:
-            row = []
-            for genome in self.genomes:
-                aligner = SequenceAlignment(motif, genome.seq)
-                score = aligner.get_alignment_scores(algo="local")
-                row.append(1 if score >= threshold_score else 0)
-            conservation_matrix.append(row)
-        conservation_matrix = np.array(conservation_matrix)
+            if len(motif) < threshold_score:
+                matrix.append([0] * len(self.genomes))
+                continue
+            diffs = min(max_diffs, (len(motif) - threshold_score) // 2)
+            matrix.extend(self.collection_index.presence_matrix([motif], diffs, indels))
+        return matrix
+
+    def motif_conservation_heatmap(self, motifs, output_path, max_diffs=1, threshold_score=4):
+        conservation_matrix = np.array(self.motif_conservation_matrix(motifs, max_diffs, threshold_score))
         # Summary print
         for i, motif in enumerate(motifs):
             present_in = [self.genomes[j].id for j in range(len(self.genomes)) if conservation_matrix[i][j] == 1]
             print(f"Motif '{motif}' conserved in {len(present_in)} genome(s): {present_in}")
         # Plot
+        plt = pyplot()
         fig, ax = plt.subplots(figsize=(14, 5))
         cax = ax.imshow(conservation_matrix, cmap="Greens", aspect='auto')
         ax.set_xticks(np.arange(len(self.genomes)))
@@ -79,25 +193,19 @@ class MitoAnalysisSystem:
         # plt.show()  # Uncomment this if you want to see the plot interactively
         plt.close()
 
-    def similarity_to_reference(self, ref_idx=0):
+    def similarity_matrix(self):
+        # N x N alignment score and identity matrices over every loaded genome
+        return self.similarity_engine.matrix()
+
+    def similarity_to_reference(self, ref_idx=0, output_path=None):
         reference = self.genomes[ref_idx]
         reference_id = reference.id
         print(f"\nReference genome: {reference_id}\n{'-'*50}")
-        results = []
-        for target in self.genomes[1:]:
-            aligner = SequenceAlignment(reference.seq, target.seq)
-            _, comp, _ = aligner.align_sequences()
-            score = aligner.get_alignment_scores()
-            matches = comp.count("*")
-            total = len(comp)
-            similarity = (matches / total) * 100 if total > 0 else 0
-            results.append({
-                "id": target.id,
-                "score": score,
-                "similarity": similarity
-            })
-            print(f"{target.id} | Score: {score} | Similarity: {similarity:.2f}%")
-        # Bar chart
+        results = self.similarity_engine.to_reference(ref_idx)
+        for r in results:
+            print(f"{r['id']} | Score: {r['score']} | Similarity: {r['similarity']:.2f}%")
+        # Bar chart, saved to output_path when given
+        plt = pyplot()
         plt.figure(figsize=(12, 5))
         ids = [r["id"] for r in results]
         similarities = [r["similarity"] for r in results]
@@ -108,7 +216,11 @@ class MitoAnalysisSystem:
         plt.xlabel("Genome ID")
         plt.xticks(rotation=90, ha='right', fontsize=6)
         plt.tight_layout()
-        plt.show()
+        if output_path is None:
+            plt.show()
+        else:
+            plt.savefig(output_path)
+            plt.close()
         
 # # Usage example - Uncomment 
 # if __name__ == "__main__":
@@ -1,59 +1,223 @@
-from flask import Flask, request, render_template, redirect, url_for, send_from_directory
+from flask import Flask, Blueprint, current_app, request, render_template, redirect, url_for, send_from_directory, jsonify, abort, session, g, Response
+from flask import stream_template, stream_with_context
 import os, uuid
+import json
+import time
+from contextlib import ExitStack
+from functools import partial
 import tempfile
-from analysis import MitoAnalysisSystem
-from models import SequenceAlignment, MotifFinder
-
-webapp = Flask(__name__)
-webapp.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
-
-mito_system = None  # Global instance
-
-
-@webapp.route('/')
+import threading
+from datasets import DatasetRegistry
+from models import SequenceAlignment
+from jobs import JobManager
+from aho_corasick import expandIUPAC
+from parser import content_hash
+from plot_cache import PlotCache
+from plotting import pyplot
+from metrics import METRICS, inc, observe, profiled
+
+views = Blueprint("mito", __name__)
+plot_lock = threading.Lock()  # pyplot keeps global figure state, one plot at a time
+
+
+def create_app(config=None):
+    # Application factory, e.g. gunicorn "app:create_app()"; importing this module does no work of its own.
+    # Background jobs and their results live in the worker process that started them, so /jobs/<id> must reach that
+    # same process: run a single worker with threads (gunicorn -w 1 --threads 8) or route each session to one worker
+    # (sticky sessions at the load balancer). Several workers also need a shared MITO_SECRET_KEY for the session cookie
+    app = Flask(__name__)
+    app.config.update(
+        UPLOAD_FOLDER=tempfile.gettempdir(),
+        # Signs the session cookie holding the dataset key; required outside debug and testing, where a random key per
+        # process would make every worker reject the others' cookies and users silently lose their dataset
+        SECRET_KEY=os.environ.get("MITO_SECRET_KEY"),
+        # Opt-in profiling: with a folder set, requests carrying ?profile=1 or an X-Profile: 1 header dump a cProfile file there
+        PROFILE_DIR=os.environ.get("MITO_PROFILE_DIR"),
+        MEMORY_BUDGET=int(os.environ.get("MITO_MEMORY_BUDGET", 1 << 30)),
+        PLOT_CACHE_BYTES=int(os.environ.get("MITO_PLOT_CACHE_BYTES", 256 << 20)),
+        JOB_WORKERS=int(os.environ.get("MITO_JOB_WORKERS", 4)),
+        # FASTA files loaded, indexed and ready before the first request (os.pathsep-separated in MITO_PRELOAD)
+        PRELOAD=[path for path in os.environ.get("MITO_PRELOAD", "").split(os.pathsep) if path],
+    )
+    app.config.update(config or {})
+    if not app.config["SECRET_KEY"]:
+        if not (app.debug or app.testing):
+            raise RuntimeError("Set MITO_SECRET_KEY (the same value in every worker) to sign session cookies")
+        app.config["SECRET_KEY"] = os.urandom(16)
+    app.extensions["mito"] = {
+        # Every uploaded FASTA stays loaded under its content hash, each session works on the one it uploaded or selected
+        "datasets": DatasetRegistry(memory_budget=app.config["MEMORY_BUDGET"], packed=True),
+        # Long analyses run here, the pages poll /jobs/<id>
+        "jobs": JobManager(max_workers=app.config["JOB_WORKERS"]),
+        # Rendered plots keyed by (dataset hash, plot type, motifs), so repeated queries reuse the PNG
+        "plots": PlotCache(os.path.join(app.config["UPLOAD_FOLDER"], "mito_plots"), app.config["PLOT_CACHE_BYTES"]),
+        "preloaded": {},  # content hash -> path of the PRELOAD files
+    }
+    app.register_blueprint(views)
+    if app.config["PRELOAD"]:
+        warm_up(app)
+    return app
+
+
+def warm_up(app):
+    # Loads the PRELOAD files with their stats and FM-indexes (memory-mapped when already saved, so forked workers share
+    # the pages) and imports pyplot, so no request pays for it; the first file is shown to sessions without an upload
+    state = app.extensions["mito"]
+    for path in app.config["PRELOAD"]:
+        key = state["datasets"].add(path)
+        state["preloaded"][key] = path
+        state["datasets"].get(key).collection_index
+        state["datasets"].trim(keep=key)
+        app.config.setdefault("DEFAULT_DATASET", key)
+    pyplot()
+
+
+def service(name):
+    # The current app's dataset registry, job manager or plot cache
+    return current_app.extensions["mito"][name]
+
+
+@views.before_app_request
+def start_request():
+    g.start = time.perf_counter()
+    g.profile = ExitStack()
+    g.profile_path = None
+    folder = current_app.config['PROFILE_DIR']
+    if folder and (request.args.get("profile") == "1" or request.headers.get("X-Profile") == "1"):
+        os.makedirs(folder, exist_ok=True)
+        g.profile_path = os.path.join(folder, f"{request.endpoint}-{int(time.time())}-{uuid.uuid4().hex[:8]}.prof")
+        g.profile.enter_context(profiled(g.profile_path))
+
+
+@views.after_app_request
+def record_request(response):
+    observe("http_request_seconds", time.perf_counter() - g.start,
+            endpoint=request.endpoint or "unknown", method=request.method, status=response.status_code)
+    return response
+
+
+@views.teardown_app_request
+def stop_profile(exc):
+    if "profile" in g:
+        g.profile.close()
+
+
+def submit_job(kind, fn, *args):
+    # A profiled request profiles its job too, into a second file next to the request's
+    if g.profile_path:
+        fn = partial(profiled_job, g.profile_path.replace(".prof", f".{kind}-job.prof"), fn)
+    job = service("jobs").submit(kind, fn, *args)
+    # Whatever the job built (an index, stats, alignments) counts against the memory budget once it is done
+    registry, key = service("datasets"), current_key()
+    job.future.add_done_callback(lambda _: registry.trim(keep=key))
+    return job
+
+
+def profiled_job(path, fn, job, *args):
+    with profiled(path):
+        return fn(job, *args)
+
+
+@views.route('/metrics')
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+@views.route('/')
 def index():
     return render_template("index.html")
 
 
-@webapp.route('/upload', methods=['POST'])
+@views.route('/upload', methods=['POST'])
 def upload():
-    global mito_system
     fasta_file = request.files['fasta']
     if fasta_file:
-        path = os.path.join(webapp.config['UPLOAD_FOLDER'], fasta_file.filename)
-        fasta_file.save(path)
-        mito_system = MitoAnalysisSystem(path)
-        return redirect(url_for('menu'))  
+        # Saved under a private name first, then renamed after its content so uploads with the same filename never clash
+        tmp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"mito_upload_{uuid.uuid4().hex}.fasta")
+        fasta_file.save(tmp_path)
+        inc("bytes_loaded_total", os.path.getsize(tmp_path), source="upload")
+        path = upload_path(content_hash(tmp_path))
+        os.replace(tmp_path, path)
+        session['dataset'] = service("datasets").add(path)
+        return redirect(url_for('.menu'))  
     return "Upload failed."
 
-@webapp.route('/menu')
+
+def upload_path(key):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], f"mito_{key}.fasta")
+
+
+def load_dataset(key):
+    # Dataset for a content hash; one evicted from memory, or uploaded through another worker process, is reloaded from its file
+    registry = service("datasets")
+    system = registry.get(key)
+    if system is None:
+        path = service("preloaded").get(key) or upload_path(key)
+        if os.path.exists(path):
+            system = registry.get(registry.add(path))
+    return system
+
+
+def current_key():
+    # The session's dataset key, the first preloaded one for sessions without an upload
+    return session.get('dataset') or current_app.config.get('DEFAULT_DATASET')
+
+
+def current_dataset():
+    # The session's dataset, None when there is nothing to show
+    key = current_key()
+    return load_dataset(key) if key else None
+
+
+@views.route('/datasets/<key>')
+def select_dataset(key):
+    # Switch this session to a dataset someone else uploaded (key = content hash)
+    if len(key) != 64 or set(key) - set("0123456789abcdef") or load_dataset(key) is None:
+        abort(404)
+    session['dataset'] = key
+    return redirect(url_for('.menu'))
+
+
+@views.route('/menu')
 def menu():
+    mito_system = current_dataset()
     if mito_system is None:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     return render_template("menu.html")
 
 
 
-@webapp.route('/stats')
+@views.route('/stats')
 def stats():
+    mito_system = current_dataset()
     if mito_system is None:
-        return redirect(url_for('index'))
-    df = mito_system.data.copy()
-    df["GC content (%)"] = df["seq"].apply(lambda x: (x.count("G") + x.count("C")) / len(x) * 100)
-    return render_template("stats.html", rows=df.to_dict(orient='records'))
-
-
-@webapp.route('/compare', methods=['GET'])
+        return redirect(url_for('.index'))
+    table = mito_system.stats
+    sort = request.args.get("sort", "id")
+    if sort not in table.columns:
+        sort = "id"
+    order = "desc" if request.args.get("order") == "desc" else "asc"
+    per_page = max(1, min(request.args.get("per_page", 100, type=int), 1000))
+    pages = max(1, -(-len(table) // per_page))
+    page = max(1, min(request.args.get("page", 1, type=int), pages))
+    ordered = table.sort_values(sort, ascending=(order == "asc"), kind="stable")
+    rows = ordered.iloc[(page - 1) * per_page:page * per_page].to_dict(orient='records')
+    return render_template("stats.html", rows=rows, sort=sort, order=order, page=page, pages=pages, per_page=per_page)
+
+
+@views.route('/compare', methods=['GET'])
 def compare_form():
+    mito_system = current_dataset()
     if mito_system is None:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     genomes = mito_system.genomes
     return render_template("compare_select.html", genomes=genomes)
 
-@webapp.route('/compare/results', methods=['POST'])
+@views.route('/compare/results', methods=['POST'])
 def compare_results():
+    mito_system = current_dataset()
     if mito_system is None:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     id1 = request.form.get("id1")
     id2 = request.form.get("id2")
@@ -67,37 +231,58 @@ def compare_results():
     if not g1 or not g2:
         return "Invalid genome IDs selected."
 
-    aligner = SequenceAlignment(g1.seq, g2.seq)
-    seq1, comp, seq2 = aligner.align_sequences()
-
-    # Block-wise formatting 
-    block_size = 60
-    rows = []
-    for i in range(0, len(seq1), block_size):
-        block1 = seq1[i:i+block_size]
-        comp_block = comp[i:i+block_size]
-        block2 = seq2[i:i+block_size]
-        id_width = max(len(g1.id), len(g2.id))
-        rows.append((
-            f"{g1.id.ljust(id_width)}: {block1}",
+    job = submit_job("compare", compare_job, g1, g2)
+    return redirect(url_for('.job_page', job_id=job.id))
+
+
+def compare_job(job, g1, g2):
+    # Only the alignment is kept, blocks are formatted per page (or streamed) when the result is viewed
+    job.progress(0, 1)
+    result = SequenceAlignment(g1.seq, g2.seq).align(algo="banded")
+    job.progress(1, 1)
+    return "compare.html", dict(g1=g1, g2=g2, result=result)
+
+
+BLOCK_SIZE = 60  # alignment columns per displayed block
+
+
+def alignment_rows(result, id1, id2, start=0, stop=None):
+    # Block-wise formatting, one block at a time
+    id_width = max(len(id1), len(id2))
+    for _, block1, comp_block, block2 in result.blocks(BLOCK_SIZE, start, stop):
+        yield (
+            f"{id1.ljust(id_width)}: {block1}",
             " " * (id_width + 2) + comp_block,
-            f"{g2.id.ljust(id_width)}: {block2}"
-        ))
+            f"{id2.ljust(id_width)}: {block2}"
+        )
+
 
-    return render_template("compare.html", g1=g1, g2=g2, rows=rows)
+def compare_page(g1, g2, result):
+    # ?page=&per_page= renders one window of blocks; ?stream=1 sends the whole alignment, each block as soon as it is formatted
+    blocks = result.block_count(BLOCK_SIZE)
+    if request.args.get("stream") == "1":
+        rows = alignment_rows(result, g1.id, g2.id)
+        return Response(stream_template("compare.html", g1=g1, g2=g2, result=result, rows=rows, page=1, pages=1, per_page=blocks))
+    per_page = max(1, min(request.args.get("per_page", 50, type=int), 1000))
+    pages = max(1, -(-blocks // per_page))
+    page = max(1, min(request.args.get("page", 1, type=int), pages))
+    rows = alignment_rows(result, g1.id, g2.id, (page - 1) * per_page, page * per_page)
+    return render_template("compare.html", g1=g1, g2=g2, result=result, rows=rows, page=page, pages=pages, per_page=per_page)
 
 
-@webapp.route('/motifs', methods=['GET'])
+@views.route('/motifs', methods=['GET'])
 def motifs_form():
+    mito_system = current_dataset()
     if mito_system is None:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     return render_template("motif_form.html")
 
 
-@webapp.route('/motifs/results', methods=['POST'])
+@views.route('/motifs/results', methods=['POST'])
 def motifs_results():
+    mito_system = current_dataset()
     if mito_system is None:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     motif_input = request.form.get("motifs") or ""
     motifs = [m.strip().upper() for m in motif_input.splitlines() if m.strip()]
@@ -105,19 +290,39 @@ def motifs_results():
     if not motifs:
         return "No motifs entered."
 
-    counts = []
-    for motif in motifs:
-        finder = MotifFinder(motif)
-        row = [finder.count_occurrences(genome.seq) for genome in mito_system.genomes]
-        counts.append((motif, row))
+    try:
+        for motif in motifs:
+            expandIUPAC(motif)
+    except ValueError as e: # invalid or over-ambiguous IUPAC motif, rejected before a job is queued
+        return str(e)
+
+    job = submit_job("motifs", motifs_job, mito_system, motifs, service("plots"))
+    return redirect(url_for('.job_page', job_id=job.id))
 
-    # Image path
-    img_filename = f"motif_plot_{uuid.uuid4().hex}.png"
-    img_path = os.path.join(webapp.config['UPLOAD_FOLDER'], img_filename)
 
-    # Plot
-    import matplotlib.pyplot as plt
-    import numpy as np
+def motifs_job(job, mito_system, motifs, plots):
+    job.progress(0, 2)
+    counts = list(zip(motifs, mito_system.motif_count_matrix(motifs)))
+    job.progress(1, 2)
+
+    # Plot, drawn only if this dataset and motif list have not been plotted before
+    plot_type = "bar" if len(motifs) == 1 else "heatmap"
+    img_filename = plots.get_or_render(
+        PlotCache.key(mito_system.content_hash, plot_type, motifs),
+        partial(render_motif_plot, mito_system, motifs, counts),
+    )
+    job.progress(2, 2)
+
+    return "motif_results.html", dict(motifs=counts, genomes=mito_system.genomes, heatmap_img=img_filename)
+
+
+def render_motif_plot(mito_system, motifs, counts, img_path):
+    with plot_lock:
+        plot_motifs(mito_system, motifs, counts, img_path)
+
+
+def plot_motifs(mito_system, motifs, counts, img_path):
+    plt = pyplot()
 
     if len(motifs) == 1:
         # === BAR PLOT ===
@@ -138,44 +343,104 @@ def motifs_results():
         # Heatmap
         mito_system.motif_conservation_heatmap(motifs, img_path)
 
-    return render_template("motif_results.html", motifs=counts, genomes=mito_system.genomes, heatmap_img=img_filename)
-
-@webapp.route('/uploads/<filename>')
+@views.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(webapp.config['UPLOAD_FOLDER'], filename)
+    return send_plot(filename)
 
 
-@webapp.route('/heatmaps/<filename>')
+@views.route('/heatmaps/<filename>')
 def heatmap_file(filename):
-    return send_from_directory(webapp.config['UPLOAD_FOLDER'], filename)
+    return send_plot(filename)
 
 
-@webapp.route('/similarity', methods=['GET'])
+def send_plot(filename):
+    # Plot names are content hashes: the name is the ETag (cache hits touch the file, so its mtime is no use) and browsers may keep it for a day
+    response = send_from_directory(service("plots").folder, filename, max_age=86400, conditional=True, etag=os.path.splitext(filename)[0])
+    response.cache_control.public = True
+    return response
+
+
+@views.route('/similarity', methods=['GET'])
 def similarity_form():
+    mito_system = current_dataset()
     if mito_system is None:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     genomes = mito_system.genomes
     return render_template("similarity_select.html", genomes=genomes)
 
-@webapp.route('/similarity/results', methods=['POST'])
+@views.route('/similarity/results', methods=['POST'])
 def similarity_results():
+    mito_system = current_dataset()
     if mito_system is None:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     ref_id = request.form.get("ref_id")
     # find the genome index for this id
     ref_idx = next((i for i, g in enumerate(mito_system.genomes) if g.id == ref_id), 0)
     reference = mito_system.genomes[ref_idx]
-    results = []
-    for i, target in enumerate(mito_system.genomes):
-        if i == ref_idx:
-            continue
-        aligner = SequenceAlignment(reference.seq, target.seq)
-        _, comp, _ = aligner.align_sequences()
-        score = aligner.get_alignment_scores()
-        matches = comp.count("*")
-        similarity = (matches / len(comp)) * 100 if comp else 0
-        results.append({"id": target.id, "score": score, "similarity": similarity})
-    return render_template("similarity.html", reference=reference, results=results)
-
-
-webapp.run(debug=True)
+    top_k = request.form.get("top_k", type=int) # blank = exact alignment against every genome
+    if top_k is not None and top_k < 1:
+        return "The number of closest genomes must be at least 1.", 400
+    job = submit_job("similarity", similarity_job, mito_system, ref_idx, top_k)
+    return redirect(url_for('.job_page', job_id=job.id))
+
+
+def similarity_job(job, mito_system, ref_idx, top_k):
+    # job.progress gets (pairs aligned, pairs to align) from the engine and stops it when the job is cancelled
+    results = mito_system.similarity_engine.to_reference(ref_idx, progress=job.progress, top_k=top_k)
+    return "similarity.html", dict(reference=mito_system.genomes[ref_idx], results=results)
+
+
+# Job functions return (template, context); the result page renders it once the job is done
+@views.route('/jobs/<job_id>')
+def job_page(job_id):
+    job = service("jobs").get(job_id) or abort(404)
+    if job.status == "done":
+        return redirect(url_for('.job_result', job_id=job.id))
+    return render_template("job.html", job=job.to_dict())
+
+
+@views.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    job = service("jobs").get(job_id) or abort(404)
+    return jsonify(job.to_dict())
+
+
+@views.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = service("jobs").get(job_id) or abort(404)
+    if job.status != "done":
+        return redirect(url_for('.job_page', job_id=job.id))
+    template, context = job.result
+    if job.kind == "compare":
+        return compare_page(**context)
+    return render_template(template, **context)
+
+
+@views.route('/jobs/<job_id>/alignment')
+def job_alignment(job_id):
+    # NDJSON window of a finished comparison, one block per line: ?offset= first block, ?limit= number of blocks (default: to the end)
+    job = service("jobs").get(job_id) or abort(404)
+    if job.kind != "compare" or job.status != "done":
+        abort(404)
+    result = job.result[1]["result"]
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = request.args.get("limit", type=int)
+    stop = None if limit is None else offset + max(0, limit)
+
+    def generate():
+        for column, block1, comp_block, block2 in result.blocks(BLOCK_SIZE, offset, stop):
+            yield json.dumps({"block": column // BLOCK_SIZE, "column": column, "seq1": block1, "comparison": comp_block, "seq2": block2}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@views.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    job = service("jobs").cancel(job_id) or abort(404)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(job.to_dict())
+    return redirect(url_for('.job_page', job_id=job.id))
+
+
+if __name__ == "__main__":
+    create_app({"DEBUG": True}).run(debug=True)
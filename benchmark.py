@@ -0,0 +1,245 @@
+# Benchmarks for the indexing, alignment, parsing and web hot paths on synthetic genomes of configurable size
+#
+#   python benchmark.py --count 20 --length 16569 --output bench.json
+#   python benchmark.py --output new.json --baseline bench.json     # exits 1 if any case got slower than --threshold
+#
+# Every case reports the first (cold) run, min/median of the repeats that follow, and the tracemalloc peak of one extra run.
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from fm_index_query import BWT, FMIndex, FMIndexQuery
+from global_alignment_algo import globalAlignment
+from local_alignment_algo import localAlignment
+from models import MitochondrialDNA, MotifFinder, SequenceAlignment
+from parser import FastaParser, FastaIndex
+
+MOTIFS = ["GATC", "TATA", "ATCG", "CGCG", "TTAA", "CTAG"]
+
+
+def synthetic_genomes(count, length, divergence=0.05, seed=0):
+    # count genomes derived from one random ancestor, each with substitutions and short indels at the given rate
+    rng = random.Random(seed)
+    ancestor = [rng.choice("ACGT") for _ in range(length)]
+    genomes = []
+    for _ in range(count):
+        seq = []
+        for base in ancestor:
+            r = rng.random()
+            if r < divergence * 0.8:
+                seq.append(rng.choice("ACGT"))                        # substitution
+            elif r < divergence * 0.9:
+                continue                                              # deletion
+            elif r < divergence:
+                seq.append(base + rng.choice("ACGT"))                 # insertion
+            else:
+                seq.append(base)
+        genomes.append("".join(seq))
+    return genomes
+
+
+def write_fasta(path, genomes, width=80):
+    with open(path, "w") as f:
+        for i, seq in enumerate(genomes, start=1):
+            f.write(f">NC_{i:06d} Species_{i} mitochondrion, complete genome\n")
+            for start in range(0, len(seq), width):
+                f.write(seq[start:start + width] + "\n")
+
+
+def measure(fn, repeat, memory=True):
+    # fn is called 1 + repeat times (+1 traced); the first call is reported separately since it pays for lazy builds and caches
+    start = time.perf_counter()
+    fn()
+    first = time.perf_counter() - start
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    result = {
+        "first_seconds": first,
+        "min_seconds": min(times) if times else first,
+        "median_seconds": statistics.median(times) if times else first,
+        "repeat": repeat,
+    }
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def core_cases(genomes, fasta_path, align_length):
+    # name -> callable for the library code paths
+    text = genomes[0]
+    short1, short2 = genomes[0][:align_length], genomes[1][:align_length]
+    index = FMIndex(text)
+    mito = [MitochondrialDNA(seq=seq, ID=f"NC_{i:06d}") for i, seq in enumerate(genomes, start=1)]
+    return {
+        "bwt": lambda: BWT(text),
+        "fm_index_build": lambda: FMIndex(text),
+        "fm_index_query": lambda: FMIndexQuery(text, "GATC"),
+        "fm_index_count": lambda: [index.count(m) for m in MOTIFS],
+        "fm_index_locate": lambda: [index.locate(m) for m in MOTIFS],
+        "motif_finder_count": lambda: [MotifFinder(m).count_occurrences(g) for m in MOTIFS for g in mito],
+        "motif_finder_search": lambda: [MotifFinder(m).search_motif(g) for m in MOTIFS for g in mito],
+        "motif_finder_count_many_iupac": lambda: MotifFinder.count_many(["GANTC", "TATAWA", "YCGR"], mito),
+        # Pure-Python reference implementations, on the first align_length bases only since they are quadratic in time and memory
+        "global_alignment": lambda: globalAlignment(short1, short2, -2, 1, -1),
+        "local_alignment": lambda: localAlignment(short1, short2, -2, 1, -1),
+        # The engines the app uses, on full genomes; _run bypasses the result cache
+        "global_alignment_numpy": lambda: SequenceAlignment(genomes[0], genomes[1])._run(-2, 1, -1, "global_numpy"),
+        "local_alignment_numpy": lambda: SequenceAlignment(genomes[0], genomes[1])._run(-2, 1, -1, "local_numpy"),
+        "banded_alignment": lambda: SequenceAlignment(genomes[0], genomes[1])._run(-2, 1, -1, "banded"),
+        "hirschberg_alignment": lambda: SequenceAlignment(genomes[0], genomes[1])._run(-2, 1, -1, "hirschberg"),
+        "global_alignment_score": lambda: SequenceAlignment(genomes[0], genomes[1]).get_alignment_scores(algo="global_numpy"),
+        "fasta_parse": lambda: FastaParser().parse(fasta_path),
+        "fasta_stream": lambda: sum(len(record.seq) for record in FastaParser().stream(fasta_path)),
+        "fasta_index_fetch": lambda: [FastaIndex(fasta_path).fetch(f"NC_{i:06d}", 100, 1100) for i in range(1, len(genomes) + 1)],
+    }
+
+
+def web_cases(fasta_path, top_k):
+    # name -> callable driving the Flask routes through the test client; job routes are timed until the job is done
+    from app import create_app
+    client = create_app({"TESTING": True}).test_client()
+    with open(fasta_path, "rb") as f:
+        data = f.read()
+    client.post("/upload", data={"fasta": (io.BytesIO(data), "bench.fasta")}, content_type="multipart/form-data")
+
+    def run_job(url, form):
+        response = client.post(url, data=form)
+        job_id = response.headers["Location"].rsplit("/", 1)[1]
+        while True:
+            status = client.get(f"/jobs/{job_id}/status").get_json()
+            if status["status"] in ("done", "failed", "cancelled"):
+                break
+            time.sleep(0.01)
+        if status["status"] != "done":
+            raise RuntimeError(f"{url} job {status['status']}: {status['error']}")
+        return client.get(f"/jobs/{job_id}/result")
+
+    similarity_form = {"ref_id": "NC_000001"}
+    if top_k:
+        similarity_form["top_k"] = str(top_k)
+    return {
+        "web_stats": lambda: client.get("/stats?sort=gc&order=desc"),
+        "web_compare": lambda: run_job("/compare/results", {"id1": "NC_000001", "id2": "NC_000002"}),
+        "web_motifs": lambda: run_job("/motifs/results", {"motifs": "\n".join(MOTIFS)}),
+        "web_similarity": lambda: run_job("/similarity/results", similarity_form),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # Names of cases whose min time grew by more than threshold (a ratio) against the baseline file
+    regressions = []
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        ratio = result["min_seconds"] / old["min_seconds"] if old["min_seconds"] > 0 else 1.0
+        flag = "REGRESSION" if ratio > threshold else ""
+        print(f"{name:32s} {old['min_seconds']:10.4f}s -> {result['min_seconds']:10.4f}s  x{ratio:5.2f} {flag}", file=sys.stderr)
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the indexing, alignment, parsing and web hot paths.")
+    parser.add_argument("--count", type=int, default=20, help="number of synthetic genomes")
+    parser.add_argument("--length", type=int, default=16569, help="length of each synthetic genome")
+    parser.add_argument("--divergence", type=float, default=0.05, help="per-base mutation rate between genomes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--align-length", type=int, default=1000, help="prefix length for the pure-Python alignments")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs after the first one")
+    parser.add_argument("--top-k", type=int, default=5, help="top_k for the similarity route, 0 aligns against every genome")
+    parser.add_argument("--only", nargs="*", help="run only these cases")
+    parser.add_argument("--no-web", action="store_true", help="skip the Flask route cases")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--output", help="write results as JSON to this file (default: stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    args = parser.parse_args(argv)
+
+    genomes = synthetic_genomes(args.count, args.length, args.divergence, args.seed)
+    workdir = tempfile.mkdtemp(prefix="mito_bench_")
+    fasta_path = os.path.join(workdir, "bench.fasta")
+    write_fasta(fasta_path, genomes)
+
+    try:
+        cases = core_cases(genomes, fasta_path, args.align_length)
+        if not args.no_web:
+            cases.update(web_cases(fasta_path, args.top_k))
+        if args.only:
+            unknown = set(args.only) - cases.keys()
+            if unknown:
+                parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+            cases = {name: cases[name] for name in args.only}
+
+        results = {}
+        for name, fn in cases.items():
+            results[name] = measure(fn, args.repeat, memory=not args.no_memory)
+            print(f"{name:32s} first {results[name]['first_seconds']:10.4f}s  min {results[name]['min_seconds']:10.4f}s", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "count": args.count,
+            "length": args.length,
+            "divergence": args.divergence,
+            "seed": args.seed,
+            "align_length": args.align_length,
+            "top_k": args.top_k,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("count") != args.count or baseline["meta"].get("length") != args.length:
+            print("warning: baseline was run on a different dataset size", file=sys.stderr)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+# Command-line batch runner for large FASTA collections: per-genome stats, motif counts and similarity,
+# computed on a process pool and streamed to CSV or Parquet so memory stays flat; an interrupted run picks up where it stopped
+#
+#   python cli.py stats genomes.fasta -o stats.csv --jobs 8
+#   python cli.py motifs genomes.fasta -o motifs.parquet --motifs GATC TATA GANTC
+#   python cli.py similarity genomes.fasta -o sim.csv --reference NC_012920 --jobs 8
+#   python cli.py similarity genomes.fasta -o all.csv --all --jobs 8 --resume
+
+import argparse
+import csv
+import os
+import sys
+from itertools import combinations, islice
+import multiprocessing
+
+import pandas as pd
+
+from parser import FastaIndex
+from models import MitochondrialDNA, MotifFinder, SequenceAlignment
+from aho_corasick import expandIUPAC
+from genome_stats import genomeStats
+
+_worker_index = None                                                 # per-process FastaIndex, sequences are read from disk by name
+_worker_options = None
+_MP_CONTEXT = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn" # workers never inherit a forked parent's state
+
+
+def _init_worker(fasta_file, options):
+    global _worker_index, _worker_options
+    _worker_index = FastaIndex(fasta_file)
+    _worker_options = options
+
+
+def _genome(name):
+    return MitochondrialDNA(seq=_worker_index.fetch(name), ID=name, description=_worker_index.description(name))
+
+
+def _stats_task(names):
+    return genomeStats([_genome(name) for name in names], k=_worker_options["k"]).to_dict(orient="records")
+
+
+def _motifs_task(names):
+    motifs = _worker_options["motifs"]
+    counts = MotifFinder.count_many(motifs, [_genome(name) for name in names])[0]
+    return [dict(id=name, **{motif: counts[m][g] for m, motif in enumerate(motifs)}) for g, name in enumerate(names)]
+
+
+def _similarity_task(pairs):
+    rows = []
+    for id1, id2 in pairs:
+        result = SequenceAlignment(_worker_index.fetch(id1), _worker_index.fetch(id2)).align(
+            _worker_options["gap_pen"], _worker_options["match"], _worker_options["mismatch"], _worker_options["algo"],
+        )
+        rows.append({"id1": id1, "id2": id2, "score": result.score, "identity": result.identity})
+    return rows
+
+
+class CsvSink:
+    # Appends rows to a CSV file, flushing after every batch so a killed run loses at most the batch in flight
+    def __init__(self, path, columns, resume):
+        self._path = path
+        self._columns = columns
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists and resume:
+            self._truncate_partial_line()
+            with open(path, newline="") as f:
+                header = next(csv.reader(f), None)
+            if header != columns:
+                raise SystemExit(f"{path} has columns {header}, expected {columns}; cannot resume")
+        self._file = open(path, "a" if exists and resume else "w", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=columns)
+        if not (exists and resume):
+            self._writer.writeheader()
+            self._file.flush()
+
+    def _truncate_partial_line(self):
+        # A run killed mid-write can leave half a row at the end, drop everything after the last newline
+        with open(self._path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - (1 << 16)))
+            tail = f.read()
+            if not tail.endswith(b"\n"):
+                f.truncate(size - len(tail) + tail.rfind(b"\n") + 1)
+
+    def done_keys(self, key_columns):
+        # Keys of the rows already written, read one row at a time
+        keys = set()
+        if not os.path.exists(self._path):
+            return keys
+        with open(self._path, newline="") as f:
+            for row in csv.DictReader(f):
+                keys.add(tuple(row[column] for column in key_columns))
+        return keys
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    # A directory of Parquet part files, one per batch, each written under a temporary name and renamed into place;
+    # pandas.read_parquet(path) reads the directory as one table
+    def __init__(self, path, columns, resume):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow), or write .csv instead")
+        self._path = path
+        self._columns = columns
+        if os.path.isdir(path) and not resume:
+            for name in os.listdir(path):
+                if name.startswith("part-"):
+                    os.remove(os.path.join(path, name))
+        os.makedirs(path, exist_ok=True)
+        self._parts = len(self._part_files())
+
+    def _part_files(self):
+        return sorted(name for name in os.listdir(self._path) if name.startswith("part-") and name.endswith(".parquet"))
+
+    def done_keys(self, key_columns):
+        keys = set()
+        for name in self._part_files():
+            part = pd.read_parquet(os.path.join(self._path, name), columns=list(key_columns))
+            keys.update(tuple(str(v) for v in row) for row in part.itertuples(index=False))
+        return keys
+
+    def write(self, rows):
+        if not rows:
+            return
+        name = f"part-{self._parts:06d}.parquet"
+        tmp_path = os.path.join(self._path, f".{name}.tmp")
+        pd.DataFrame(rows, columns=self._columns).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(self._path, name))
+        self._parts += 1
+
+    def close(self):
+        pass
+
+
+def open_sink(path, columns, resume):
+    if path.endswith(".parquet"):
+        return ParquetSink(path, columns, resume)
+    return CsvSink(path, columns, resume)
+
+
+def number(text):
+    # Alignment parameters stay integers unless a fraction is given, like the library defaults
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def batched(items, size):
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run(task, batches, total, sink, fasta_file, options, jobs, batch_rows):
+    # Feeds batches to the pool a window at a time (never the whole task list) and writes rows as results come back
+    done = 0
+    pending = []
+    window = max(1, jobs) * 4
+    context = multiprocessing.get_context(_MP_CONTEXT)
+    pool = context.Pool(jobs, initializer=_init_worker, initargs=(fasta_file, options)) if jobs > 1 else None
+    if pool is None:
+        _init_worker(fasta_file, options)
+    try:
+        batches = iter(batches)
+        while True:
+            chunk = list(islice(batches, window))
+            if not chunk:
+                break
+            results = pool.imap_unordered(task, chunk) if pool else map(task, chunk)
+            for rows in results:
+                pending.extend(rows)
+                done += len(rows)
+                if len(pending) >= batch_rows:
+                    sink.write(pending)
+                    pending = []
+                print(f"\r{done}/{total}", end="", file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        sink.write(pending) # rows finished before an interruption are kept for --resume
+        sink.close()
+        print(file=sys.stderr)
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch analyses over a FASTA collection.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("fasta", help="input FASTA file (a .fai index is written next to it)")
+    common.add_argument("-o", "--output", required=True, help="output .csv file or .parquet directory")
+    common.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    common.add_argument("--resume", action="store_true", help="skip rows already in the output instead of starting over")
+    common.add_argument("--overwrite", action="store_true", help="replace an existing output")
+    common.add_argument("--batch-rows", type=int, default=1000, help="rows buffered between writes")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stats = commands.add_parser("stats", parents=[common], help="per-genome length, composition and k-mer statistics")
+    stats.add_argument("--k", type=int, default=4, help="k-mer size for the spectrum columns")
+    stats.add_argument("--genomes-per-task", type=int, default=64)
+
+    motifs = commands.add_parser("motifs", parents=[common], help="motif occurrence counts per genome (IUPAC codes allowed)")
+    motifs.add_argument("--motifs", nargs="+", required=True)
+    motifs.add_argument("--genomes-per-task", type=int, default=64)
+
+    similarity = commands.add_parser("similarity", parents=[common], help="pairwise alignment score and identity")
+    target = similarity.add_mutually_exclusive_group(required=True)
+    target.add_argument("--reference", help="genome id to align every other genome against")
+    target.add_argument("--all", action="store_true", help="every pair of genomes")
+    similarity.add_argument("--algo", default="banded", choices=sorted(SequenceAlignment.ALGORITHMS))
+    similarity.add_argument("--gap-pen", type=number, default=-2)
+    similarity.add_argument("--match", type=number, default=1)
+    similarity.add_argument("--mismatch", type=number, default=-1)
+    similarity.add_argument("--pairs-per-task", type=int, default=4)
+
+    args = parser.parse_args(argv)
+    exists = os.path.exists(args.output) and (os.path.isdir(args.output) or os.path.getsize(args.output) > 0)
+    if exists and not (args.resume or args.overwrite):
+        parser.error(f"{args.output} exists, pass --resume to continue it or --overwrite to replace it")
+
+    index = FastaIndex(args.fasta)
+    names = index.names()
+    jobs = max(1, args.jobs)
+
+    if args.command == "stats":
+        columns = ["id", "description", "length", "gc", "A", "C", "G", "T", "N", "other", "distinct_kmers", "kmer_entropy"]
+        key_columns, options, task, per_task = ["id"], {"k": args.k}, _stats_task, args.genomes_per_task
+    elif args.command == "motifs":
+        motif_list = [m.upper() for m in args.motifs]
+        for motif in motif_list:
+            try:
+                expandIUPAC(motif)
+            except ValueError as e: # invalid or over-ambiguous, caught before the output is opened and the pool starts
+                parser.error(str(e))
+        columns = ["id"] + motif_list
+        key_columns, options, task, per_task = ["id"], {"motifs": motif_list}, _motifs_task, args.genomes_per_task
+    else:
+        if args.reference is not None and args.reference not in index:
+            parser.error(f"unknown reference genome {args.reference}")
+        columns = ["id1", "id2", "score", "identity"]
+        options = {"algo": args.algo, "gap_pen": args.gap_pen, "match": args.match, "mismatch": args.mismatch}
+        key_columns, task, per_task = ["id1", "id2"], _similarity_task, args.pairs_per_task
+
+    sink = open_sink(args.output, columns, args.resume)
+    done = sink.done_keys(key_columns) if args.resume else set()
+
+    if args.command == "similarity":
+        if args.all:
+            items = combinations(names, 2)
+            total = len(names) * (len(names) - 1) // 2
+        else:
+            items = ((args.reference, name) for name in names if name != args.reference)
+            total = len(names) - 1
+        items = (pair for pair in items if pair not in done)
+    else:
+        items = (name for name in names if (name,) not in done)
+        total = len(names)
+    total -= len(done)
+
+    written = run(task, batched(items, per_task), total, sink, args.fasta, options, jobs, args.batch_rows)
+    print(f"{written} rows written to {args.output}" + (f" ({len(done)} already there)" if done else ""), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
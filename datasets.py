@@ -0,0 +1,94 @@
+# Registry of loaded datasets keyed by FASTA content hash, with a shared memory budget and least-recently-used eviction
+
+import threading
+from collections import OrderedDict
+from analysis import MitoAnalysisSystem
+from parser import content_hash
+from metrics import inc, timer
+
+
+class DatasetRegistry:
+    def __init__(self, memory_budget: int = 1 << 30, **system_options):
+        self._memory_budget = memory_budget                          # bytes for all datasets together
+        self._system_options = system_options                        # passed on to every MitoAnalysisSystem
+        self._datasets = OrderedDict()                               # content hash -> MitoAnalysisSystem, least recently used first
+        self._lock = threading.Lock()
+
+    @property
+    def memory_budget(self):
+        return self._memory_budget
+
+    def add(self, fasta_file):
+        # Load a FASTA file, or reuse the dataset already loaded from identical content; returns its key
+        key = content_hash(fasta_file)
+        with self._lock:
+            if key in self._datasets:
+                self._datasets.move_to_end(key)
+                inc("cache_hits_total", cache="dataset")
+                return key
+        inc("cache_misses_total", cache="dataset")
+        with timer("dataset_load_seconds"):
+            system = MitoAnalysisSystem(fasta_file, **self._system_options)
+        with self._lock:
+            self._datasets.setdefault(key, system)                    # a concurrent upload of the same file may have won
+            self._datasets.move_to_end(key)
+        self.trim(keep=key)
+        return key
+
+    def get(self, key):
+        # The dataset for key (None if unknown or evicted), marked as most recently used
+        with self._lock:
+            system = self._datasets.get(key)
+            if system is not None:
+                self._datasets.move_to_end(key)
+            return system
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._datasets
+
+    def __len__(self):
+        with self._lock:
+            return len(self._datasets)
+
+    def memory_usage(self):
+        # {key: {component: bytes}} in least recently used order
+        with self._lock:
+            return {key: system.memory_usage() for key, system in self._datasets.items()}
+
+    def trim(self, keep=None):
+        # Bring memory back under budget, called after a dataset is added and after a job has built something.
+        # Over budget: drop the heaviest derived structure of the least recently used dataset first,
+        # and only unload whole datasets once nothing derived is left to drop. The dataset keep is never touched.
+        # Victims are picked under the lock but released outside it, since release() waits for any build in progress
+        with self._lock:
+            releases = self._pick_victims(keep)
+        for system, name in releases:
+            system.release(name)
+            inc("cache_evictions_total", cache=name)
+
+    def _pick_victims(self, keep):
+        # [(system, component)] to release; whole datasets are removed from the registry right away
+        usage = {key: system.memory_usage() for key, system in self._datasets.items() if key != keep}
+        total = sum(sum(parts.values()) for parts in usage.values())
+        if keep in self._datasets:
+            total += sum(self._datasets[keep].memory_usage().values())
+        releases = []
+        while total > self._memory_budget and usage:
+            victim = None
+            for key, parts in usage.items():
+                derived = [(parts[name], name) for name in MitoAnalysisSystem.DERIVED if parts[name] > 0]
+                if derived:
+                    victim = (key, max(derived))
+                    break
+            if victim is not None:
+                key, (size, name) = victim
+                releases.append((self._datasets[key], name))
+                usage[key][name] = 0
+                total -= size
+                continue
+            key = next(iter(usage))
+            total -= sum(usage.pop(key).values())
+            del self._datasets[key]
+            inc("cache_evictions_total", cache="dataset")
+        return releases
@@ -1,37 +1,307 @@
 # Burrows-Wheeler algorythm implemented for string matching through FM indexing
 
+import json
+import os
+import shutil
+
+import numpy as np
+from suffix_array import suffixArray, bwtFromSuffixArray
+from aho_corasick import IUPAC
+from metrics import inc, timed
+
+@timed("bwt_seconds")
 def BWT(T, DoReturnOffsets=False):
     # Initialize by adding an end character if it isn't already there
     if T[-1] != "$":
         T += "$"
-    n = len(T)
-    rotations = sorted(range(n), key=lambda i: T[i:]+T[:i]) # Store the starting index of each rotation, used later to find the offset of a query match
-    L = "".join(T[i-1 % n] for i in rotations) # All values of i-1 are less than the total length n, so the modulo returns i-1, except for -1 which returns n-1, effectively looping around to the last character $ when i=0
+    rotations = suffixArray(T) # Starting index of each rotation in sorted order (= suffix array, since $ is unique), used later to find the offset of a query match
+    L = bwtFromSuffixArray(T, rotations) # Character preceding each sorted rotation, looping around to the last character $ for the rotation starting at 0
     if DoReturnOffsets:
         return L, rotations
     else:
         return L
 
+INDEX_FORMAT_VERSION = 2 # 2: collection indexes hold uppercased genomes
+
+class FMIndex:
+    # Reusable FM-index over a single text: the BWT, Occ checkpoints and a sampled suffix array are built once, queries only run the backward search
+    ARRAYS = ("L", "C", "alphabet", "occ", "sa_rows", "sa_values") # arrays written to disk, one .npy file each
+    RESERVED = "$"                                                    # characters an approximate match may never use
+    @timed("fm_index_build_seconds")
+    def __init__(self, T, checkpoint_interval=64, sa_sample_rate=32):
+        inc("index_builds_total", kind=type(self).__name__)
+        L, sa = BWT(T, True)
+        self.L = np.frombuffer(L.encode("ascii"), dtype=np.uint8)   # BWT as byte codes
+        self.n = len(self.L)
+        self.checkpoint_interval = checkpoint_interval               # rows between two Occ checkpoints (rank scans at most this many bytes)
+        self.sa_sample_rate = sa_sample_rate                         # keep SA entries for every sa_sample_rate-th text offset (memory vs locate speed)
+        counts = np.bincount(self.L, minlength=256)
+        self.C = np.concatenate(([0], np.cumsum(counts)[:-1]))      # C[c] = index of the first row starting with c in the F column
+        self.alphabet = np.flatnonzero(counts).astype(np.uint8)     # sorted byte codes present in the text
+        # Occ checkpoints: occ[b, j] = occurrences of alphabet[j] in L[:b*checkpoint_interval]
+        k = checkpoint_interval
+        occ_dtype = np.int32 if self.n < 2**31 else np.int64
+        self.occ = np.zeros((self.n // k + 1, len(self.alphabet)), dtype=occ_dtype)
+        for col, code in enumerate(self.alphabet):
+            self.occ[1:, col] = np.cumsum(self.L == code)[k-1::k]
+        # Sampled SA: the rows whose offset is a multiple of the sample rate, kept sorted for binary search
+        sampled = sa % sa_sample_rate == 0
+        self.sa_rows = np.flatnonzero(sampled)
+        self.sa_values = sa[sampled]
+        self._init_lookups()
+
+    def _init_lookups(self):
+        # Plain Python lists for the per-character lookups on the hot path
+        self._C = self.C.tolist()
+        self._col = [-1] * 256
+        for col, code in enumerate(self.alphabet.tolist()):
+            self._col[code] = col
+        self._col_array = np.array(self._col, dtype=np.int64)
+        self._search_codes = [code for code in self.alphabet.tolist() if chr(code) not in self.RESERVED]
+
+    # ON-DISK FORMAT: a directory holding one .npy per array plus meta.json, opened with numpy memmaps so worker processes share the pages
+    def _meta(self):
+        return {
+            "version": INDEX_FORMAT_VERSION,
+            "n": self.n,
+            "checkpoint_interval": self.checkpoint_interval,
+            "sa_sample_rate": self.sa_sample_rate,
+        }
+
+    def _load_meta(self, meta):
+        self.n = meta["n"]
+        self.checkpoint_interval = meta["checkpoint_interval"]
+        self.sa_sample_rate = meta["sa_sample_rate"]
+
+    def save(self, path):
+        # Write into a private directory first and rename it into place, so readers never see a partial index
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(tmp_path, name + ".npy"), np.asarray(getattr(self, name)))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(self._meta(), f)
+        try:
+            os.rename(tmp_path, path)
+        except OSError: # Another process saved the same index first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format in {path}")
+        index = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(index, name, np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+        index.C = np.array(index.C) # small, kept in memory for fancy indexing
+        index._load_meta(meta)
+        index._init_lookups()
+        inc("index_loads_total")
+        return index
+
+    @classmethod
+    def load_or_build(cls, path, *args, **kwargs):
+        # Open a saved index if one exists at path, otherwise build it and save it there
+        if os.path.isdir(path):
+            try:
+                return cls.load(path)
+            except (OSError, ValueError, KeyError):
+                shutil.rmtree(path, ignore_errors=True) # stale or corrupt, rebuild below
+        index = cls(*args, **kwargs)
+        index.save(path)
+        return index
+
+    @property
+    def nbytes(self):
+        # Heap memory held by the arrays; memory-mapped ones live in the page cache and are not counted
+        arrays = [getattr(self, name) for name in self.ARRAYS]
+        return sum(a.nbytes for a in arrays if not isinstance(a, np.memmap))
+
+    def rank(self, code, i):
+        # Occurrences of byte code in L[:i]: nearest checkpoint + scan of at most checkpoint_interval bytes
+        col = self._col[code]
+        if col < 0:
+            return 0
+        b = i // self.checkpoint_interval
+        start = b * self.checkpoint_interval
+        return int(self.occ[b, col]) + int(np.count_nonzero(self.L[start:i] == code))
+
+    def backward_search(self, P):
+        # Range [top, bottom) of the rows prefixed by P, only the two bounds are carried between steps
+        top, bottom = 0, self.n
+        for char in reversed(P):
+            code = ord(char)
+            if code > 255 or self._col[code] < 0: # Character absent from the text => empty range
+                return 0, 0
+            top = self._C[code] + self.rank(code, top)
+            bottom = self._C[code] + self.rank(code, bottom)
+            if top >= bottom: # No rotation has this suffix of P as its prefix
+                return 0, 0
+        return top, bottom
+
+    def rank_many(self, codes, rows):
+        # Vectorised rank for parallel arrays of byte codes and rows (codes must be present in the text)
+        k = self.checkpoint_interval
+        blocks = rows // k
+        starts = blocks * k
+        ranks = self.occ[blocks, self._col_array[codes]].astype(np.int64)
+        for d in range(k): # Scan the partial blocks in lock-step, at most checkpoint_interval passes
+            inside = starts + d < rows
+            if not inside.any():
+                break
+            ranks += inside & (self.L[np.minimum(starts + d, self.n - 1)] == codes)
+        return ranks
+
+    def offsets_of_rows(self, rows):
+        # Walk LF from every row in lock-step until each reaches a sampled SA entry, each step moves one position back in the text
+        rows = np.asarray(rows, dtype=np.int64)
+        offsets = np.empty(len(rows), dtype=np.int64)
+        pending = np.arange(len(rows))
+        steps = 0
+        while len(pending):
+            pos = np.searchsorted(self.sa_rows, rows)
+            found = self.sa_rows[np.minimum(pos, len(self.sa_rows) - 1)] == rows
+            offsets[pending[found]] = self.sa_values[pos[found]] + steps
+            pending, rows = pending[~found], rows[~found]
+            codes = self.L[rows]
+            rows = self.C[codes] + self.rank_many(codes, rows) # LF mapping
+            steps += 1
+        return offsets
+
+    def count(self, P):
+        if not P:
+            return 0
+        top, bottom = self.backward_search(P)
+        return bottom - top
+
+    def locate(self, P):
+        if not P:
+            return []
+        top, bottom = self.backward_search(P)
+        return sorted(self.offsets_of_rows(np.arange(top, bottom)).tolist())
+
+    def query(self, P):
+        offsets = self.locate(P)
+        return len(offsets), offsets # Return number of hits + offset of each hit within T
+
+    # APPROXIMATE SEARCH: backtracking through the backward search, every branch carries its remaining difference budget
+    def _approximate_ranges(self, P, i, top, bottom, diffs_left, used, indels, ranges):
+        # P holds the set of byte codes each pattern position accepts
+        if i < 0:
+            if (top, bottom) != (0, self.n): # every pattern character deleted, not a hit
+                ranges.append((top, bottom, used))
+            return
+        codes_p = P[i]
+        for code in self._search_codes:
+            cost = 0 if code in codes_p else 1
+            if cost > diffs_left and not indels:
+                continue
+            new_top = self._C[code] + self.rank(code, top)
+            new_bottom = self._C[code] + self.rank(code, bottom)
+            if new_top >= new_bottom:
+                continue
+            if cost <= diffs_left: # match or substitution
+                self._approximate_ranges(P, i-1, new_top, new_bottom, diffs_left-cost, used+cost, indels, ranges)
+            if indels and diffs_left and i < len(P) - 1: # extra character in the text (not at the pattern's end, that is just a shorter hit)
+                self._approximate_ranges(P, i, new_top, new_bottom, diffs_left-1, used+1, indels, ranges)
+        if indels and diffs_left: # pattern character missing from the text
+            self._approximate_ranges(P, i-1, top, bottom, diffs_left-1, used+1, indels, ranges)
+
+    def approximate_search(self, P, max_diffs=1, indels=False):
+        # Sorted (offset, differences) of every hit of P with at most max_diffs mismatches (or edits when indels=True), fewest differences kept per offset
+        # IUPAC codes in P match any of their bases without counting as a difference (and still match themselves)
+        if not P:
+            return []
+        ranges = []
+        allowed = [frozenset(ord(c) for c in char + IUPAC.get(char, "")) for char in P]
+        self._approximate_ranges(allowed, len(P) - 1, 0, self.n, max_diffs, 0, indels, ranges)
+        if not ranges:
+            return []
+        # One lock-step locate over the rows of every range, then the fewest differences per offset
+        rows = np.concatenate([np.arange(top, bottom) for top, bottom, _ in ranges])
+        used = np.repeat([u for _, _, u in ranges], [bottom - top for top, bottom, _ in ranges])
+        offsets = self.offsets_of_rows(rows)
+        order = np.lexsort((used, offsets))
+        offsets, used = offsets[order], used[order]
+        first = np.concatenate(([True], offsets[1:] != offsets[:-1]))
+        return list(zip(offsets[first].tolist(), used[first].tolist()))
+
+class CollectionFMIndex(FMIndex):
+    # One FM-index over a whole set of genomes: sequences are concatenated with a separator, hits are mapped back to their genome
+    # Genomes and motifs are uppercased, so soft-masked (lowercase) regions match like the Aho-Corasick scan does
+    SEPARATOR = "#"
+    ARRAYS = FMIndex.ARRAYS + ("starts",)
+    RESERVED = "$" + SEPARATOR
+
+    def __init__(self, ids, seqs, checkpoint_interval=64, sa_sample_rate=32):
+        self.ids = list(ids)
+        lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(lengths + 1)[:-1])) # offset of each genome in the concatenated text
+        super().__init__((self.SEPARATOR.join(seqs) + "$").upper(), checkpoint_interval, sa_sample_rate)
+
+    def _meta(self):
+        meta = super()._meta()
+        meta["ids"] = self.ids
+        return meta
+
+    def _load_meta(self, meta):
+        super()._load_meta(meta)
+        self.ids = meta["ids"]
+
+    def _to_genomes(self, offsets):
+        # Genome index and local offset for sorted offsets in the concatenated text
+        genomes = np.searchsorted(self.starts, offsets, side="right") - 1 # the separator stops any hit from spanning two genomes
+        return genomes, offsets - self.starts[genomes]
+
+    def genome_hits(self, P):
+        # Genome index and local offset of every hit, sorted by genome then offset
+        if not P:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        top, bottom = self.backward_search(P.upper())
+        return self._to_genomes(np.sort(self.offsets_of_rows(np.arange(top, bottom))))
+
+    def approximate_query(self, P, max_diffs=1, indels=False):
+        # {genome ID: sorted [(offset within that genome, differences)]} from a single backtracking walk
+        hits = {genome_id: [] for genome_id in self.ids}
+        found = self.approximate_search(P.upper(), max_diffs, indels)
+        if found:
+            genomes, offsets = self._to_genomes(np.array([offset for offset, _ in found], dtype=np.int64))
+            for g, offset, (_, diffs) in zip(genomes.tolist(), offsets.tolist(), found):
+                hits[self.ids[g]].append((offset, diffs))
+        return hits
+
+    def presence_matrix(self, motifs, max_diffs=1, indels=False):
+        # Motif x genome 0/1 matrix: 1 when the genome holds the motif within max_diffs differences
+        matrix = []
+        for motif in motifs:
+            found = self.approximate_search(motif.upper(), max_diffs, indels)
+            row = np.zeros(len(self.ids), dtype=int)
+            if found:
+                genomes, _ = self._to_genomes(np.array([offset for offset, _ in found], dtype=np.int64))
+                row[genomes] = 1
+            matrix.append(row.tolist())
+        return matrix
+
+    def count_per_genome(self, P):
+        genomes, _ = self.genome_hits(P)
+        return np.bincount(genomes, minlength=len(self.ids)).tolist()
+
+    def query(self, P):
+        # {genome ID: (number of hits, sorted offsets within that genome)} from a single backward search
+        genomes, offsets = self.genome_hits(P)
+        bounds = np.searchsorted(genomes, np.arange(len(self.ids) + 1))
+        return {
+            genome_id: (int(bounds[i+1] - bounds[i]), offsets[bounds[i]:bounds[i+1]].tolist())
+            for i, genome_id in enumerate(self.ids)
+        }
+
+    def count_matrix(self, motifs):
+        # Motif x genome count matrix, one search per motif
+        return [self.count_per_genome(motif) for motif in motifs]
+
+@timed("fm_index_query_seconds")
 def FMIndexQuery(T, P):
-    # INITIALIZATION
-    L, offsets = BWT(T, True) # Start by converting T to BWT(T) for FM-indexing
-    char_count = {char:L.count(char) for char in set(L)} # Number of times each character shows up in the seq
-    char_Fpos = {char:sum(char_count[p] for p in set(L) if p < char) for char in set(L)} # For each character, sum the counts of all characters that precede it in the seq's alphabet, which results in the index of the character's first occurrence (0th rank) in the F column of the BWM
-    # FM INDEX QUERY
-    if P[-1] in T:
-        prefix_indexes = [x for x in range(char_Fpos[P[-1]], char_Fpos[P[-1]]+char_count[P[-1]])] # Initial range is indexes of F that match the last character of P => All rotations of T that have P[-1] as a prefix
-    else: 
-        return None # If the last character is not even present in T, the search doesn't start, as the initial range would be empty
-    query_char = -2
-    while query_char >= (-len(P)):
-        c = P[query_char]
-        matching_prefix_indexes = [e for e in prefix_indexes if L[e] == c] # The range is restricted by querying for the previous character in the query string P
-        prefix_indexes = matching_prefix_indexes
-        if len(prefix_indexes) == 0: # Stop the search if no rotations have P's suffix as their prefix
-            break
-        bottom_rank = L[:prefix_indexes[0]].count(c)
-        bottom_index = char_Fpos[c] + bottom_rank # FL mapping of the first matching character in L to F, all other characters follow
-        top_index = bottom_index + len(prefix_indexes) # These two indexes define the range for the next query
-        prefix_indexes = [x for x in range(bottom_index, top_index)]
-        query_char -= 1
-    return len(prefix_indexes), sorted([offsets[i] for i in prefix_indexes]) # Return number of hits + offset of each hit within T
+    # One-off query, builds a throwaway index; keep an FMIndex around when querying the same text repeatedly
+    return FMIndex(T).query(P)
@@ -0,0 +1,60 @@
+# Columnar per-genome statistics, computed with array operations over batches of concatenated genomes
+
+import numpy as np
+import pandas as pd
+
+_CODES = np.full(256, 5, dtype=np.int64)                              # A C G T N, 5 = any other character
+for _code, _base in enumerate("ACGTN"):
+    _CODES[ord(_base)] = _code
+COLUMNS = ["A", "C", "G", "T", "N", "other"]
+
+
+def _batchStats(seqs, k):
+    lengths = np.array([len(s) for s in seqs], dtype=np.int64)
+    owner = np.repeat(np.arange(len(seqs)), lengths)                 # genome of every base in the concatenation
+    codes = _CODES[np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8)]
+    composition = np.bincount(owner * 6 + codes, minlength=6 * len(seqs)).reshape(-1, 6)
+    # k-mer spectrum: windows of k A/C/G/T bases that stay inside one genome
+    n = len(codes) - k + 1
+    spectrum = np.zeros((len(seqs), 4 ** k), dtype=np.int64)
+    if n > 0:
+        bad = np.concatenate(([0], np.cumsum(codes > 3)))
+        valid = (bad[k:] == bad[:-k]) & (owner[:n] == owner[k-1:])
+        kmers = np.zeros(n, dtype=np.int64)
+        for p in range(k):
+            kmers = kmers * 4 + np.minimum(codes[p:p+n], 3)
+        spectrum = np.bincount(owner[:n][valid] * 4 ** k + kmers[valid], minlength=len(seqs) * 4 ** k).reshape(len(seqs), -1)
+    totals = spectrum.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        freqs = np.where(totals > 0, spectrum / np.maximum(totals, 1), 0)
+        entropy = -np.where(freqs > 0, freqs * np.log2(np.where(freqs > 0, freqs, 1)), 0).sum(axis=1)
+    return lengths, composition, (spectrum > 0).sum(axis=1), entropy
+
+
+def genomeStats(genomes, k=4, batch_bases=1 << 26):
+    # One row per genome: length, GC %, base composition, N count and a k-mer spectrum summary
+    # (distinct k-mers and Shannon entropy in bits); at most batch_bases bases are concatenated at a time
+    parts = []
+    batch, size = [], 0
+    for genome in list(genomes) + [None]:
+        if genome is not None:
+            seq = genome.seq
+            batch.append(seq)
+            size += len(seq)
+        if batch and (genome is None or size >= batch_bases):
+            parts.append(_batchStats(batch, k))
+            batch, size = [], 0
+    if not parts:
+        return pd.DataFrame(columns=["id", "description", "length", "gc"] + COLUMNS + ["distinct_kmers", "kmer_entropy"])
+    lengths, composition, distinct, entropy = (np.concatenate(arrays) for arrays in zip(*parts))
+    table = pd.DataFrame({
+        "id": [g.id for g in genomes],
+        "description": [g.description for g in genomes],
+        "length": lengths,
+    })
+    table["gc"] = np.where(lengths > 0, (composition[:, 1] + composition[:, 2]) / np.maximum(lengths, 1) * 100, 0.0)
+    for col, name in enumerate(COLUMNS):
+        table[name] = composition[:, col]
+    table["distinct_kmers"] = distinct
+    table["kmer_entropy"] = entropy
+    return table
@@ -0,0 +1,114 @@
+# In-process background jobs: a thread pool runs long analyses while the web pages poll for progress
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from metrics import observe
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind: str):
+        self._id = uuid.uuid4().hex
+        self._kind = kind
+        self.status = "queued"                 # queued -> running -> done | failed | cancelled
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def progress(self, done: int, total: int):
+        # Progress callback for the analysis code; it is also where a cancelled job stops
+        if self.cancelled:
+            raise JobCancelled()
+        self.done = done
+        self.total = total
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None and self.future.cancel(): # never started
+            self.status = "cancelled"
+
+    def to_dict(self):
+        return {
+            "id": self._id,
+            "kind": self._kind,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers: int = 4, max_jobs: int = 200):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._max_jobs = max_jobs
+
+    def submit(self, kind: str, fn, *args, **kwargs):
+        # fn(job, *args, **kwargs) runs on a worker thread, its return value becomes job.result
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancelled:
+            job.status = "cancelled"
+            return
+        job.status = "running"
+        start = time.perf_counter()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        observe("job_seconds", time.perf_counter() - start, kind=job.kind, status=job.status)
+
+    def _evict(self):
+        # Forget the oldest finished jobs once more than max_jobs are tracked
+        if len(self._jobs) <= self._max_jobs:
+            return
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.created)
+        for job in finished[:len(self._jobs) - self._max_jobs]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
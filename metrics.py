@@ -0,0 +1,143 @@
+# Process-wide counters and timing histograms for the hot paths, rendered in the Prometheus text format by the /metrics route
+
+import bisect
+import cProfile
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "mito_"
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0) # seconds, upper bounds
+HELP = {
+    "bwt_seconds": "Time spent building a BWT and its suffix array",
+    "fm_index_build_seconds": "Time spent building an FM-index",
+    "fm_index_query_seconds": "Time spent in one-shot FMIndexQuery calls",
+    "alignment_seconds": "Time spent aligning one pair of sequences, by algorithm",
+    "alignment_traceback_seconds": "Time spent tracing back through a DP matrix",
+    "fasta_parse_seconds": "Time spent reading a FASTA file, by reader (parse, stream, fai index build)",
+    "dataset_load_seconds": "Time spent loading a dataset into the registry, sequences and up-front stats included",
+    "plot_render_seconds": "Time spent drawing a plot",
+    "http_request_seconds": "Flask request latency, by endpoint, method and status",
+    "job_seconds": "Background job run time, by kind and final status",
+    "dp_cells_total": "Alignment DP cells filled, by algorithm (len(A) x len(B) for the full-matrix ones, the band for banded, every divide-and-conquer pass for hirschberg); divide by alignment_seconds_sum for cells per second",
+    "index_builds_total": "FM-indexes built from scratch, by kind",
+    "index_loads_total": "FM-indexes opened from disk",
+    "cache_hits_total": "Cache lookups answered from the cache, by cache",
+    "cache_misses_total": "Cache lookups that had to compute the value, by cache",
+    "cache_evictions_total": "Entries dropped to respect a cache limit, by cache",
+    "bytes_loaded_total": "Bytes read from FASTA files and uploads, by source",
+}
+
+
+def _labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _formatLabels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self._buckets = tuple(buckets)
+        self._counters = {}                                           # name -> {label key: value}
+        self._histograms = {}                                         # name -> {label key: [bucket counts..., sum, count]}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = _labelKey(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _labelKey(labels)
+        slot = bisect.bisect_left(self._buckets, seconds)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * (len(self._buckets) + 2)
+            if slot < len(self._buckets):
+                values[slot] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        # Decorator form of timer()
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def value(self, name, **labels):
+        # Current counter value, for the benchmarks and debugging
+        with self._lock:
+            return self._counters.get(name, {}).get(_labelKey(labels), 0)
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                full = PREFIX + name
+                if name in HELP:
+                    lines.append(f"# HELP {full} {HELP[name]}")
+                lines.append(f"# TYPE {full} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{full}{_formatLabels(key)} {value}")
+            for name in sorted(self._histograms):
+                full = PREFIX + name
+                if name in HELP:
+                    lines.append(f"# HELP {full} {HELP[name]}")
+                lines.append(f"# TYPE {full} histogram")
+                for key, values in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(self._buckets, values):
+                        cumulative += count
+                        lines.append(f"{full}_bucket{_formatLabels(key, [('le', repr(bound))])} {cumulative}")
+                    lines.append(f"{full}_bucket{_formatLabels(key, [('le', '+Inf')])} {values[-1]}")
+                    lines.append(f"{full}_sum{_formatLabels(key)} {values[-2]}")
+                    lines.append(f"{full}_count{_formatLabels(key)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared instance used by every module
+METRICS = Metrics()
+inc = METRICS.inc
+observe = METRICS.observe
+timer = METRICS.timer
+timed = METRICS.timed
+
+
+@contextmanager
+def profiled(path):
+    # Run the block under cProfile and dump the stats to path (open with pstats or snakeviz)
+    # Yields None without profiling when another profiler already owns the interpreter (Python 3.12+ allows only one)
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        yield None
+        return
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
@@ -1,28 +1,90 @@
-from fm_index_query import FMIndexQuery     
+import threading
+from collections import OrderedDict
+from fm_index_query import FMIndex
+from sketch import MinHashSketch
+from packed_sequence import PackedSequence
+from aho_corasick import AhoCorasick
+from metrics import inc, timer
 from global_alignment_algo import globalAlignment
 from local_alignment_algo import localAlignment
+from numpy_alignment import (
+    globalAlignmentNumpy, localAlignmentNumpy,
+    globalAlignmentScore, localAlignmentScore, hirschbergAlignment, bandedAlignment,
+)
 
 
 class DNASequence:
-    def __init__(self, seq: str, ID: str, description: str = ""):
-        self._seq = seq
+    def __init__(self, seq, ID: str, description: str = "", loader=None, length: int = None):
+        self._seq = seq                        # str, PackedSequence, or None for sequences left on disk
         self._id = ID
         self._description = description
+        self._loader = loader                  # loader(start, end) -> bases, for sequences left on disk (seq=None)
+        self._length = length
+
+    def pack(self):
+        # Switch to 2-bit storage; the string is rebuilt on demand by the seq property
+        if isinstance(self._seq, str):
+            self._seq = PackedSequence.from_string(self._seq)
+        return self
+
+    @property
+    def is_packed(self):
+        return isinstance(self._seq, PackedSequence)
+
+    def view(self, start: int, end: int):
+        # Zero-copy PackedSequence slice of a packed sequence
+        if not self.is_packed:
+            raise ValueError("view() needs a packed sequence, call pack() first")
+        if start < 0 or end > self.get_length():
+            raise ValueError("Subsequence indices out of range")
+        return self._seq[start:end]
 
     def get_subsequence(self, start: int, end: int):
-        if start < 0 or end > len(self._seq):
+        if start < 0 or end > self.get_length():
             raise ValueError("Subsequence indices out of range")
+        if self._seq is None:
+            return self._loader(start, end)
+        if self.is_packed:
+            return str(self._seq[start:end])
         return self._seq[start:end]
 
     def get_GC_content(self):
-        gc_count = self._seq.count("G") + self._seq.count("C")
-        return (gc_count / len(self._seq)) * 100
+        if self.is_packed:
+            return (self._seq.gc_count() / len(self._seq)) * 100
+        seq = self.seq
+        gc_count = seq.count("G") + seq.count("C")
+        return (gc_count / len(seq)) * 100
+
+    def get_composition(self):
+        # {"A", "C", "G", "T", "other"} base counts
+        if self.is_packed:
+            return self._seq.composition()
+        seq = self.seq
+        counts = {base: seq.count(base) for base in "ACGT"}
+        counts["other"] = len(seq) - sum(counts.values())
+        return counts
 
     def get_length(self):
+        if self._seq is None:
+            return self._length
+        return len(self._seq)
+
+    @property
+    def nbytes(self):
+        # Memory held by the sequence itself: 0 when it stays on disk, 1 byte per base as a string
+        if self._seq is None:
+            return 0
+        if self.is_packed:
+            return self._seq.nbytes
         return len(self._seq)
 
     @property
     def seq(self):
+        # Lazily loaded and packed sequences are rebuilt on every access, only the compact form stays in memory
+        if self._seq is None:
+            return self._loader(0, self._length)
+        if self.is_packed:
+            return str(self._seq)
         return self._seq
 
     @property
@@ -35,43 +97,190 @@ class DNASequence:
 
 
 class MitochondrialDNA(DNASequence):
-    def __init__(self, seq: str, ID: str, description: str = ""):
-        super().__init__(seq, ID, description)
+    def __init__(self, seq: str, ID: str, description: str = "", loader=None, length: int = None):
+        super().__init__(seq, ID, description, loader, length)
+        self._fm_index = None
+        self._sketch = None
+
+    @property
+    def fm_index(self):
+        # Built on first query and kept for the lifetime of the genome; uppercased like the Aho-Corasick scan
+        if self._fm_index is None:
+            self._fm_index = FMIndex(self.seq.upper())
+        return self._fm_index
+
+    @property
+    def sketch(self):
+        # k-mer MinHash sketch for approximate similarity ranking
+        if self._sketch is None:
+            self._sketch = MinHashSketch(self.seq)
+        return self._sketch
+
+    @property
+    def index_nbytes(self):
+        return self._fm_index.nbytes if self._fm_index is not None else 0
+
+    def release_index(self):
+        # Drop the cached FM-index, the next query rebuilds it
+        self._fm_index = None
 
 
 class MotifFinder:
     def __init__(self, motif_seq: str):
-        self._motif_seq = motif_seq
+        self._motif_seq = motif_seq.upper()                           # case-insensitive, whichever of the index or automaton runs
+
+    def _index_for(self, target):
+        # Genomes carry their own cached index, plain strings get a throwaway one
+        if isinstance(target, MitochondrialDNA):
+            return target.fm_index
+        return FMIndex(target.upper())
+
+    def count_occurrences(self, target):
+        return self._index_for(target).count(self._motif_seq)
 
-    def count_occurrences(self, target_seq: str):
-        return FMIndexQuery(target_seq, self._motif_seq)[0]
+    def search_motif(self, target):
+        return self._index_for(target).locate(self._motif_seq)
+
+    @staticmethod
+    def count_many(motifs, genomes):
+        # One automaton for all motifs (IUPAC codes allowed), one pass per genome: (counts, offsets) as motif x genome matrices
+        automaton = AhoCorasick(motifs)
+        columns = [automaton.scan(g.seq if isinstance(g, DNASequence) else g) for g in genomes]
+        offsets = [[column[i] for column in columns] for i in range(len(motifs))]
+        counts = [[len(hits) for hits in row] for row in offsets]
+        return counts, offsets
+
+    def approximate_search(self, target, max_diffs: int = 1, indels: bool = False):
+        # [(offset, differences)] for hits within max_diffs mismatches, or edits when indels=True
+        return self._index_for(target).approximate_search(self._motif_seq, max_diffs, indels)
+
+class AlignmentResult:
+    # Everything derived from one alignment pass: gapped strings, score and the match/mismatch/gap counts
+    def __init__(self, seq1_gapped: str, comparison: str, seq2_gapped: str, score):
+        self._seq1_gapped = seq1_gapped
+        self._comparison = comparison
+        self._seq2_gapped = seq2_gapped
+        self._score = score
+        self._matches = comparison.count("*")
+        self._mismatches = comparison.count("|")
+        self._gaps = comparison.count(" ")
+
+    @property
+    def seq1_gapped(self):
+        return self._seq1_gapped
+
+    @property
+    def comparison(self):
+        return self._comparison
+
+    @property
+    def seq2_gapped(self):
+        return self._seq2_gapped
+
+    @property
+    def score(self):
+        return self._score
+
+    @property
+    def matches(self):
+        return self._matches
+
+    @property
+    def mismatches(self):
+        return self._mismatches
+
+    @property
+    def gaps(self):
+        return self._gaps
+
+    @property
+    def length(self):
+        return len(self._comparison)
+
+    @property
+    def identity(self):
+        # Percentage of alignment columns that are matches
+        return (self._matches / self.length) * 100 if self.length > 0 else 0
+
+    def block_count(self, block_size: int = 60):
+        return -(-self.length // block_size)
+
+    def blocks(self, block_size: int = 60, start: int = 0, stop: int = None):
+        # (first column, seq1 block, comparison block, seq2 block) for blocks start..stop-1, sliced one at a time as they are consumed
+        stop = self.block_count(block_size) if stop is None else min(stop, self.block_count(block_size))
+        for i in range(start * block_size, stop * block_size, block_size):
+            yield i, self._seq1_gapped[i:i+block_size], self._comparison[i:i+block_size], self._seq2_gapped[i:i+block_size]
 
-    def search_motif(self, target_seq: str):
-        return FMIndexQuery(target_seq, self._motif_seq)[1]
 
 class SequenceAlignment:
+    # algo name -> alignment function returning ([seq1_gapped, comparison, seq2_gapped], score)
+    ALGORITHMS = {
+        "global": globalAlignment,
+        "local": localAlignment,
+        "global_numpy": globalAlignmentNumpy,
+        "local_numpy": localAlignmentNumpy,
+        "hirschberg": hirschbergAlignment,
+        "banded": bandedAlignment,
+    }
+    # Algorithms that fill less (banded) or more (hirschberg) than the len(A) x len(B) matrix and report dp_cells_total themselves
+    SELF_COUNTING = ("hirschberg", "banded")
+    # algo name -> score-only function, two rows of memory; scores are identical to the full alignment
+    SCORERS = {
+        "global": globalAlignmentScore,
+        "global_numpy": globalAlignmentScore,
+        "hirschberg": globalAlignmentScore,
+        "banded": globalAlignmentScore,
+        "local": localAlignmentScore,
+        "local_numpy": localAlignmentScore,
+    }
+
+    # Results shared by all instances, keyed by (seq1, seq2, gap_pen, match, mismatch, algo), least recently used evicted first
+    CACHE_SIZE = 256
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
     def __init__(self, seq1: str, seq2: str):
         self._seq1 = seq1
         self._seq2 = seq2
 
-    def align_sequences(self, gap_pen=-2, match=1, mismatch=-1, algo: str = "global"):
-        if algo == "global":
-            seq1_gapped, comparison, seq2_gapped = globalAlignment(
-                self._seq1, self._seq2, gap_pen, match, mismatch
-            )[0]
-        elif algo == "local":
-            seq1_gapped, comparison, seq2_gapped = localAlignment(
-                self._seq1, self._seq2, gap_pen, match, mismatch
-            )[0]
-        else:
+    def _cached(self, key):
+        with self._cache_lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+        inc("cache_hits_total" if result is not None else "cache_misses_total", cache="alignment")
+        return result
+
+    def align(self, gap_pen=-2, match=1, mismatch=-1, algo: str = "global"):
+        # Single DP pass per (pair, parameters, algo); repeated calls return the memoized AlignmentResult
+        key = (self._seq1, self._seq2, gap_pen, match, mismatch, algo)
+        result = self._cached(key)
+        if result is None:
+            alignment, score = self._run(gap_pen, match, mismatch, algo)
+            result = AlignmentResult(*alignment, score)
+            with self._cache_lock:
+                self._cache[key] = result
+                if len(self._cache) > self.CACHE_SIZE:
+                    self._cache.popitem(last=False)
+                    inc("cache_evictions_total", cache="alignment")
+        return result
+
+    def _run(self, gap_pen, match, mismatch, algo):
+        if algo not in self.ALGORITHMS:
             raise ValueError("Unknown alignment algorithm.")
-        return seq1_gapped, comparison, seq2_gapped
+        if algo not in self.SELF_COUNTING:
+            inc("dp_cells_total", len(self._seq1) * len(self._seq2), algo=algo)
+        with timer("alignment_seconds", algo=algo):
+            return self.ALGORITHMS[algo](self._seq1, self._seq2, gap_pen, match, mismatch)
+
+    def align_sequences(self, gap_pen=-2, match=1, mismatch=-1, algo: str = "global"):
+        result = self.align(gap_pen, match, mismatch, algo)
+        return result.seq1_gapped, result.comparison, result.seq2_gapped
 
     def get_alignment_scores(self, gap_pen=-2, match=1, mismatch=-1, algo: str = "global"):
-        if algo == "global":
-            score = globalAlignment(self._seq1, self._seq2, gap_pen, match, mismatch)[1]
-        elif algo == "local":
-            score = localAlignment(self._seq1, self._seq2, gap_pen, match, mismatch)[1]
-        else:
+        if algo not in self.SCORERS:
             raise ValueError("Unknown alignment algorithm.")
-        return score
+        result = self._cached((self._seq1, self._seq2, gap_pen, match, mismatch, algo))
+        if result is not None: # Already aligned, no need for even a score-only pass
+            return result.score
+        return self.SCORERS[algo](self._seq1, self._seq2, gap_pen, match, mismatch)
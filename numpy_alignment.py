@@ -0,0 +1,266 @@
+# Vectorised Needleman-Wunsch and Smith-Waterman: row-wise NumPy recurrence with a uint8 traceback matrix
+# Scores, tie-breaking (DIAG > UP > LEFT) and alignments are identical to globalAlignment / localAlignment
+
+import numpy as np
+from metrics import inc, timed
+
+STOP, DIAG, UP, LEFT = 0, 1, 2, 3
+
+
+def substitutionProfile(A, B, match, mismatch):
+    # For every character of A, the substitution scores against the whole of B (computed once per distinct character)
+    B_codes = np.frombuffer(B.encode("ascii"), dtype=np.uint8)
+    return {char: np.where(B_codes == ord(char), match, mismatch) for char in set(A)}
+
+
+def _scoreType(*params):
+    return np.int64 if all(float(p).is_integer() for p in params) else np.float64
+
+
+def _fillRow(H_prev, sub, gap_pen, first, offsets, floor=None):
+    # H[j] = max(diag[j], up[j], H[j-1] + gap) is solved as a running maximum:
+    # H[j] - j*gap = max(t[j] - j*gap, H[j-1] - (j-1)*gap) with t = max(diag, up)
+    diag = H_prev[:-1] + sub
+    up = H_prev[1:] + gap_pen
+    t = np.maximum(diag, up)
+    if floor is not None:
+        t = np.maximum(t, floor)
+    shifted = np.empty_like(H_prev)
+    shifted[0] = first
+    shifted[1:] = t - offsets[1:]
+    H = np.maximum.accumulate(shifted) + offsets
+    return H, diag, up
+
+
+@timed("alignment_traceback_seconds")
+def traceback(A, B, i, j, M):
+    seqA = []
+    seqcomp = []
+    seqB = []
+    while M[i, j] != STOP:
+        case = M[i, j]
+        if case == DIAG:
+            seqA.append(A[i-1])
+            seqB.append(B[j-1])
+            seqcomp.append("*" if A[i-1] == B[j-1] else "|")
+            i -= 1
+            j -= 1
+        elif case == UP:
+            seqA.append(A[i-1])
+            seqB.append("-")
+            seqcomp.append(" ")
+            i -= 1
+        else:
+            seqA.append("-")
+            seqB.append(B[j-1])
+            seqcomp.append(" ")
+            j -= 1
+    return ["".join(reversed(seqA)), "".join(reversed(seqcomp)), "".join(reversed(seqB))]
+
+
+def globalAlignmentNumpy(A, B, gap_pen, match, mismatch):
+    m = len(A)
+    n = len(B)
+    dtype = _scoreType(gap_pen, match, mismatch)
+    profile = substitutionProfile(A, B, match, mismatch)
+    offsets = np.arange(n+1, dtype=dtype) * gap_pen
+    cM = np.empty((m+1, n+1), dtype=np.uint8)                        # traceback matrix
+    # MATRIX INITIALIZATION
+    H = offsets.copy()                                                # only the previous score row is kept
+    cM[0, 0] = STOP
+    cM[0, 1:] = LEFT
+    cM[1:, 0] = UP
+    # MATRIX FILLING
+    for i in range(1, m+1):
+        H, diag, up = _fillRow(H, profile[A[i-1]], gap_pen, i * gap_pen, offsets)
+        row = H[1:]
+        cM[i, 1:] = np.where(row == diag, DIAG, np.where(row == up, UP, LEFT))
+    # TRACEBACK
+    alignment = traceback(A, B, m, n, cM)
+    return alignment, H[n].item()
+
+
+def localAlignmentNumpy(A, B, gap_pen, match, mismatch):
+    m = len(A)
+    n = len(B)
+    dtype = _scoreType(gap_pen, match, mismatch)
+    profile = substitutionProfile(A, B, match, mismatch)
+    offsets = np.arange(n+1, dtype=dtype) * gap_pen
+    cM = np.empty((m+1, n+1), dtype=np.uint8)
+    max_score = 0
+    max_i = 0
+    max_j = 0
+    # MATRIX INITIALIZATION
+    H = np.zeros(n+1, dtype=dtype)
+    cM[0, :] = STOP
+    cM[:, 0] = STOP
+    # MATRIX FILLING
+    for i in range(1, m+1 if n else 1):                               # nothing to fill against an empty B
+        H, diag, up = _fillRow(H, profile[A[i-1]], gap_pen, 0, offsets, floor=0)
+        row = H[1:]
+        cM[i, 1:] = np.where(row == 0, STOP, np.where(row == diag, DIAG, np.where(row == up, UP, LEFT)))
+        j = int(np.argmax(row))                                       # first maximum in the row, as in the row-major scan
+        if row[j] > max_score:
+            max_score = row[j].item()
+            max_i, max_j = i, j + 1
+    # TRACEBACK
+    alignment = traceback(A, B, max_i, max_j, cM)
+    return alignment, max_score
+
+
+# LINEAR SPACE: score-only passes keep two rows, Hirschberg recovers the alignment by divide and conquer
+
+FULL_DP_CELLS = 1 << 16                                               # sub-problems at most this size are solved with the full matrix
+
+
+def _lastRowGlobal(A, B, gap_pen, match, mismatch):
+    # Global scores of A against every prefix of B, computed row by row in O(len(B)) memory
+    dtype = _scoreType(gap_pen, match, mismatch)
+    profile = substitutionProfile(A, B, match, mismatch)
+    offsets = np.arange(len(B)+1, dtype=dtype) * gap_pen
+    H = offsets.copy()
+    for i, char in enumerate(A, start=1):
+        H = _fillRow(H, profile[char], gap_pen, i * gap_pen, offsets)[0]
+    return H
+
+
+def globalAlignmentScore(A, B, gap_pen, match, mismatch):
+    # The score is symmetric in A and B, so the rows run along the shorter sequence: O(min(m, n)) memory
+    if len(B) > len(A):
+        A, B = B, A
+    return _lastRowGlobal(A, B, gap_pen, match, mismatch)[len(B)].item()
+
+
+def localAlignmentScore(A, B, gap_pen, match, mismatch):
+    if len(B) > len(A):
+        A, B = B, A
+    if not B:
+        return 0
+    dtype = _scoreType(gap_pen, match, mismatch)
+    profile = substitutionProfile(A, B, match, mismatch)
+    offsets = np.arange(len(B)+1, dtype=dtype) * gap_pen
+    H = np.zeros(len(B)+1, dtype=dtype)
+    max_score = 0
+    for char in A:
+        H = _fillRow(H, profile[char], gap_pen, 0, offsets, floor=0)[0]
+        max_score = max(max_score, H.max().item())
+    return max_score
+
+
+def _hirschberg(A, B, gap_pen, match, mismatch, pieces):
+    # Returns the score and the number of DP cells filled on the way (about 2 * len(A) * len(B) in total)
+    m = len(A)
+    n = len(B)
+    if m <= 1 or n <= 1 or (m+1) * (n+1) <= FULL_DP_CELLS:
+        alignment, score = globalAlignmentNumpy(A, B, gap_pen, match, mismatch)
+        pieces.append(alignment)
+        return score, m * n
+    # Split A in half and find where the optimal path crosses the middle row
+    mid = m // 2
+    upper = _lastRowGlobal(A[:mid], B, gap_pen, match, mismatch)
+    lower = _lastRowGlobal(A[mid:][::-1], B[::-1], gap_pen, match, mismatch)[::-1]
+    k = int(np.argmax(upper + lower))
+    _, cells_upper = _hirschberg(A[:mid], B[:k], gap_pen, match, mismatch, pieces)
+    _, cells_lower = _hirschberg(A[mid:], B[k:], gap_pen, match, mismatch, pieces)
+    return (upper[k] + lower[k]).item(), m * n + cells_upper + cells_lower
+
+
+def hirschbergAlignment(A, B, gap_pen, match, mismatch):
+    # Optimal global alignment in linear space; among co-optimal alignments it may pick a different one than the full traceback
+    pieces = []
+    score, cells = _hirschberg(A, B, gap_pen, match, mismatch, pieces)
+    inc("dp_cells_total", cells, algo="hirschberg")
+    alignment = ["".join(piece[part] for piece in pieces) for part in range(3)]
+    return alignment, score
+
+
+# BANDED: only cells within k of the diagonal are filled, the band doubles until no path leaving it can beat the result
+
+NEG = -(1 << 60)                                                      # score of cells outside the band
+
+
+class _BandView:
+    # Lets traceback() index a band-shaped matrix with full (i, j) coordinates
+    def __init__(self, band, lo):
+        self._band = band
+        self._lo = lo
+
+    def __getitem__(self, cell):
+        i, j = cell
+        return self._band[i, j - i - self._lo]
+
+
+def _offBandBound(m, n, k, gap_pen, match, mismatch):
+    # Best possible score of a path that leaves the band: it needs at least |n-m| + 2(k+1) gaps,
+    # the remaining characters pair up at best for max(match, mismatch) each
+    gaps = abs(n - m) + 2 * (k + 1)
+    if gaps > m + n:
+        return None                                                   # no path can leave the band
+    return ((m + n - gaps) / 2) * max(match, mismatch) + gaps * gap_pen
+
+
+def _bandedFill(A, B, gap_pen, match, mismatch, lo, hi):
+    m = len(A)
+    n = len(B)
+    w = hi - lo + 1
+    profile = substitutionProfile(A, B, match, mismatch)
+    t = np.arange(w)
+    offsets = t * gap_pen
+    cM = np.empty((m+1, w), dtype=np.uint8)
+    # Row 0: j = lo + t
+    j = lo + t
+    H = np.where((j >= 0) & (j <= n), j * gap_pen, NEG)
+    cM[0] = np.where(j == 0, STOP, LEFT)
+    up = np.empty(w, dtype=H.dtype)
+    up[-1] = NEG
+    for i in range(1, m+1):
+        first = i + lo                                                # column of band index 0 in this row
+        diag_row = profile[A[i-1]]
+        up[:-1] = H[1:] + gap_pen                                     # (i-1, j) sits one band index further in the previous row
+        if first >= 1 and first + w - 1 <= n:
+            # Band entirely inside the matrix: plain slices, no masking
+            diag = H + diag_row[first-1:first-1+w]                    # (i-1, j-1) sits at the same band index in the previous row
+            H = np.maximum.accumulate(np.maximum(diag, up) - offsets) + offsets
+            cM[i] = np.where(H == diag, DIAG, np.where(H == up, UP, LEFT))
+            continue
+        j = first + t
+        valid = (j >= 0) & (j <= n)
+        sub = diag_row[np.clip(j - 1, 0, max(n - 1, 0))] if n else 0
+        diag = np.where(j >= 1, H + sub, NEG)
+        best = np.where(j == 0, i * gap_pen, np.maximum(diag, up))
+        best = np.where(valid, best, NEG)
+        H = np.maximum.accumulate(best - offsets) + offsets           # left moves, as in _fillRow
+        H = np.where(valid, H, NEG)
+        cM[i] = np.where(j == 0, UP, np.where(H == diag, DIAG, np.where(H == up, UP, LEFT)))
+    return H[n - m - lo].item(), cM
+
+
+def _bandForScore(m, n, score, gap_pen, match, mismatch):
+    # Smallest k whose off-band bound falls below score: g gaps cost g*(max/2 - gap_pen) against the all-pairs maximum
+    best = max(match, mismatch)
+    gaps = int(((m + n) * best / 2 - score) // (best / 2 - gap_pen)) + 1
+    return max((gaps - abs(n - m) + 1) // 2 - 1, 0)
+
+
+def bandedAlignment(A, B, gap_pen, match, mismatch, band=32):
+    # Same score and alignment as globalAlignment: the band only stops growing once no path leaving it can tie the result,
+    # so every optimal path (and the traceback through it) lies inside the band
+    m = len(A)
+    n = len(B)
+    k = max(band, 1)
+    cells = 0                                                         # band cells filled over every attempt
+    while True:
+        lo = min(0, n - m) - k
+        hi = max(0, n - m) + k
+        full = lo <= -m and hi >= n
+        if not full and (gap_pen >= max(match, mismatch) / 2 or match < mismatch):
+            k = max(m, n)                                             # bound does not hold for these parameters, fill everything
+            continue
+        score, cM = _bandedFill(A, B, gap_pen, match, mismatch, lo, hi)
+        cells += m * (hi - lo + 1)
+        bound = _offBandBound(m, n, k, gap_pen, match, mismatch)
+        if full or bound is None or score > bound:
+            inc("dp_cells_total", cells, algo="banded")
+            return traceback(A, B, m, n, _BandView(cM, lo)), score
+        # The banded score is a lower bound on the optimum, so jump straight to a band wide enough to certify it
+        k = max(2 * k, _bandForScore(m, n, score, gap_pen, match, mismatch))
@@ -0,0 +1,140 @@
+# 2-bit packed DNA storage: four bases per byte, anything that is not A/C/G/T kept as runs in an exception list,
+# lowercase (soft-masked) stretches kept as runs in a case mask so they pack like the uppercase bases
+
+import numpy as np
+
+_ENCODE = np.full(256, 4, dtype=np.uint8)                             # 4 marks an exception character
+for _code, _base in enumerate("ACGT"):
+    _ENCODE[ord(_base)] = _code
+_DECODE = np.frombuffer(b"ACGT", dtype=np.uint8)
+_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)                      # base i of a byte sits at bits 2i..2i+1
+# Per byte: how many of its four bases are C or G, and how many are each base
+_BYTE_CODES = (np.arange(256, dtype=np.uint8)[:, None] >> _SHIFTS) & 3
+_BYTE_COUNTS = np.stack([(_BYTE_CODES == c).sum(axis=1) for c in range(4)], axis=1)
+
+
+def _runs(values):
+    # [start, end) of every run of identical non-zero values
+    changes = np.flatnonzero(np.diff(np.concatenate(([0], values, [0]))))
+    is_run = values[changes[:-1]] != 0
+    return changes[:-1][is_run], changes[1:][is_run]
+
+
+def _clip(starts, ends, lo, hi):
+    # Runs overlapping [lo, hi), clipped to it and shifted to start at 0, plus the mask of the runs kept
+    keep = (ends > lo) & (starts < hi)
+    return np.maximum(starts[keep], lo) - lo, np.minimum(ends[keep], hi) - lo, keep
+
+
+def _mask(starts, ends, length):
+    # Boolean array that is True inside the runs
+    edges = np.zeros(length + 1, dtype=np.int64)
+    np.add.at(edges, starts, 1)
+    np.add.at(edges, ends, -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+class PackedSequence:
+    def __init__(self, buffer, length, exc_starts, exc_ends, exc_chars, lower_starts, lower_ends, start=0):
+        # Use from_string(); slices share buffer, exceptions and case mask with their parent (start = offset into the parent)
+        self._buffer = buffer
+        self._start = start
+        self._length = length
+        self._exc_starts = exc_starts                                 # exception runs [start, end) holding one repeated (uppercased) character
+        self._exc_ends = exc_ends
+        self._exc_chars = exc_chars
+        self._lower_starts = lower_starts                             # lowercase runs [start, end), any characters
+        self._lower_ends = lower_ends
+
+    @classmethod
+    def from_string(cls, seq: str):
+        raw = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+        lower = (raw >= ord("a")) & (raw <= ord("z"))
+        lower_starts, lower_ends = _runs(lower.astype(np.int8))
+        upper = np.where(lower, raw - 32, raw).astype(np.uint8)
+        codes = _ENCODE[upper]
+        exceptional = codes == 4
+        # Runs of identical exception characters, e.g. a block of Ns is a single entry
+        run_starts, run_ends = _runs(np.where(exceptional, upper, 0).astype(np.int16))
+        codes[exceptional] = 0                                        # placeholder, overwritten when decoding
+        padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+        padded[:len(codes)] = codes
+        buffer = np.bitwise_or.reduce(padded.reshape(-1, 4) << _SHIFTS, axis=1).astype(np.uint8)
+        return cls(buffer, len(raw), run_starts, run_ends, upper[run_starts].tobytes(), lower_starts, lower_ends)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        # Slices are zero-copy views over the same buffer
+        if not isinstance(index, slice):
+            if index < 0:
+                index += self._length
+            if not 0 <= index < self._length:
+                raise IndexError("Packed sequence index out of range")
+            return str(self[index:index+1])
+        start, stop, step = index.indices(self._length)
+        if step != 1:
+            raise ValueError("Packed sequences only support contiguous slices")
+        return PackedSequence(self._buffer, max(stop - start, 0), self._exc_starts, self._exc_ends,
+                              self._exc_chars, self._lower_starts, self._lower_ends, self._start + start)
+
+    def codes(self):
+        # 2-bit code of every base in the view (exception positions read as A)
+        first = self._start // 4
+        last = -(-(self._start + self._length) // 4)
+        unpacked = ((self._buffer[first:last, None] >> _SHIFTS) & 3).ravel()
+        offset = self._start - first * 4
+        return unpacked[offset:offset + self._length]
+
+    def _exceptions(self):
+        # Exception runs clipped to the view, in view coordinates
+        starts, ends, keep = _clip(self._exc_starts, self._exc_ends, self._start, self._start + self._length)
+        chars = bytes(c for c, k in zip(self._exc_chars, keep) if k)
+        return starts, ends, chars
+
+    def _lowercase(self):
+        # Lowercase runs clipped to the view, in view coordinates
+        return _clip(self._lower_starts, self._lower_ends, self._start, self._start + self._length)[:2]
+
+    def __str__(self):
+        raw = _DECODE[self.codes()]
+        for s, e, char in zip(*self._exceptions()):
+            raw[s:e] = char
+        for s, e in zip(*self._lowercase()):
+            raw[s:e] |= 0x20                                          # only letters were recorded as lowercase
+        return raw.tobytes().decode("ascii")
+
+    def composition(self):
+        # {base: count} for A/C/G/T plus "other" for exception characters, without decoding
+        lo, hi = self._start, self._start + self._length
+        first_full, last_full = -(-lo // 4), hi // 4
+        if first_full < last_full:
+            counts = _BYTE_COUNTS[self._buffer[first_full:last_full]].sum(axis=0)
+            edges = np.concatenate((self[:first_full * 4 - lo].codes(), self[last_full * 4 - lo:].codes()))
+        else:
+            counts = np.zeros(4, dtype=np.int64)
+            edges = self.codes()
+        counts = counts + np.bincount(edges, minlength=4)
+        starts, ends, _ = self._exceptions()
+        other = int((ends - starts).sum())
+        counts[0] -= other                                            # exception placeholders were stored as A
+        lower_starts, lower_ends = self._lowercase()
+        if len(lower_starts):
+            # Like str.count on the decoded text, lowercase bases are not A/C/G/T: move them to "other"
+            lower = _mask(lower_starts, lower_ends, self._length) & ~_mask(starts, ends, self._length)
+            lower_counts = np.bincount(self.codes()[lower], minlength=4)
+            counts = counts - lower_counts
+            other += int(lower_counts.sum())
+        result = dict(zip("ACGT", counts.tolist()))
+        result["other"] = other
+        return result
+
+    def gc_count(self):
+        composition = self.composition()
+        return composition["G"] + composition["C"]
+
+    @property
+    def nbytes(self):
+        return (self._buffer.nbytes + self._exc_starts.nbytes + self._exc_ends.nbytes + len(self._exc_chars)
+                + self._lower_starts.nbytes + self._lower_ends.nbytes)
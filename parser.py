@@ -1,11 +1,27 @@
+import hashlib
+import os
+from collections import namedtuple
 import pandas as pd
-from Bio import SeqIO
+import time
+from metrics import inc, observe, timed
+
+FastaRecord = namedtuple('FastaRecord', ['id', 'description', 'seq'])
+
+
+def content_hash(file: str, chunk_size: int = 1 << 20):
+    # SHA-256 of the file bytes, used to key everything derived from a dataset
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 class FastaParser:
     def __init__(self):
         self._df = None
 
+    @timed("fasta_parse_seconds", reader="parse")
     def parse(self, file:str, format:str = 'fasta'):
         try: 
             with open(file) as f:
@@ -16,7 +32,9 @@ class FastaParser:
         data = {}
         output = pd.DataFrame()
 
+        from Bio import SeqIO # only parse() needs Biopython, keep it off the import path of everything else
         records = list(SeqIO.parse(file, format))
+        inc("bytes_loaded_total", os.path.getsize(file), source="parse")
         if not records:
             raise ValueError(f"No valid records found in file: {file}")
         for record in records:
@@ -36,11 +54,147 @@ class FastaParser:
         self._df = output
         return output
 
+    def stream(self, file: str):
+        # Generator of FastaRecord, one record in memory at a time (no Biopython objects, no DataFrame)
+        # fasta_parse_seconds gets the reading time only, not the time the caller spends between records
+        if not os.path.exists(file):
+            raise FileNotFoundError(f"File not found: {file}")
+        header = None
+        chunks = []
+        elapsed = 0.0
+        start = time.perf_counter()
+        with open(file) as f:
+            for line in f:
+                line = line.rstrip('\r\n')
+                if line.startswith('>'):
+                    if header is not None:
+                        elapsed += time.perf_counter() - start
+                        yield FastaRecord(header.split(None, 1)[0], header, ''.join(chunks))
+                        start = time.perf_counter()
+                    header = line[1:].strip()
+                    chunks = []
+                elif header is not None:
+                    chunks.append(line.strip())
+        elapsed += time.perf_counter() - start
+        observe("fasta_parse_seconds", elapsed, reader="stream")
+        if header is not None:
+            yield FastaRecord(header.split(None, 1)[0], header, ''.join(chunks))
+        inc("bytes_loaded_total", os.path.getsize(file), source="stream")
+
     def get_dataframe(self):
         if self._df is None:
             raise ValueError("No data: parse() not yet called")
         return self._df
 
+FaiEntry = namedtuple('FaiEntry', ['length', 'offset', 'linebases', 'linewidth'])
+
+
+class FastaIndex:
+    # samtools-style .fai offset index (name, length, offset of first base, bases per line, bytes per line)
+    # for random access into a multi-FASTA file without loading it
+    def __init__(self, file: str, index_file: str = None):
+        if not os.path.exists(file):
+            raise FileNotFoundError(f"File not found: {file}")
+        self._file = file
+        self._index_file = index_file or file + '.fai'
+        if os.path.exists(self._index_file) and os.path.getmtime(self._index_file) >= os.path.getmtime(file):
+            self._entries = self._read()
+        else:
+            self._entries = self._build()
+            try:
+                self._write()
+            except OSError: # read-only location, keep the index in memory only
+                pass
+        if not self._entries:
+            raise ValueError(f"No valid records found in file: {file}")
+
+    @timed("fasta_parse_seconds", reader="fai")
+    def _build(self):
+        entries = {}
+        name = None
+        offset = 0
+        with open(self._file, 'rb') as f:
+            for line in f:
+                if line.startswith(b'>'):
+                    if name is not None:
+                        entries[name] = FaiEntry(length, seq_offset, linebases or 0, linewidth or 0)
+                    name = line[1:].split(None, 1)[0].decode() if line[1:].strip() else ''
+                    if name in entries:
+                        raise ValueError(f"Duplicate sequence name in {self._file}: {name}")
+                    seq_offset = offset + len(line)
+                    length = 0
+                    linebases = linewidth = None
+                    last_line = False
+                elif name is not None:
+                    # Offsets are computed as if every line but the last held linebases bases in linewidth bytes, so anything
+                    # else (a longer line, a different line ending, sequence after a short or blank line) is rejected like samtools does
+                    bases = len(line.rstrip(b'\r\n'))
+                    if bases:
+                        if last_line:
+                            raise ValueError(f"Uneven line lengths in record {name} of {self._file}")
+                        if linebases is None:
+                            linebases, linewidth = bases, len(line)
+                        elif bases > linebases or (bases == linebases and len(line) != linewidth and line.endswith(b'\n')):
+                            raise ValueError(f"Uneven line lengths in record {name} of {self._file}")
+                        elif bases < linebases or len(line) != linewidth:
+                            last_line = True
+                        length += bases
+                    elif length:
+                        last_line = True # blank line: only another header may follow
+                offset += len(line)
+        if name is not None:
+            entries[name] = FaiEntry(length, seq_offset, linebases or 0, linewidth or 0)
+        return entries
+
+    def _read(self):
+        entries = {}
+        with open(self._index_file) as f:
+            for line in f:
+                name, length, offset, linebases, linewidth = line.rstrip('\n').split('\t')[:5]
+                entries[name] = FaiEntry(int(length), int(offset), int(linebases), int(linewidth))
+        return entries
+
+    def _write(self):
+        with open(self._index_file, 'w') as f:
+            for name, e in self._entries.items():
+                f.write(f"{name}\t{e.length}\t{e.offset}\t{e.linebases}\t{e.linewidth}\n")
+
+    def names(self):
+        return list(self._entries)
+
+    def length(self, name: str):
+        return self._entries[name].length
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def _byte(self, e, pos):
+        return e.offset + (pos // e.linebases) * e.linewidth + pos % e.linebases if e.linebases else e.offset
+
+    def fetch(self, name: str, start: int = 0, end: int = None):
+        # Bases [start, end) of one record, read straight from its byte range
+        e = self._entries[name]
+        end = e.length if end is None else min(end, e.length)
+        if start < 0 or start > end:
+            raise ValueError("Subsequence indices out of range")
+        with open(self._file, 'rb') as f:
+            f.seek(self._byte(e, start))
+            raw = f.read(self._byte(e, end) - self._byte(e, start))
+        inc("bytes_loaded_total", len(raw), source="fai")
+        return raw.replace(b'\n', b'').replace(b'\r', b'').decode()
+
+    def description(self, name: str, max_header: int = 1 << 16):
+        # The header line sits right before the first base, read it back instead of storing it
+        e = self._entries[name]
+        with open(self._file, 'rb') as f:
+            f.seek(max(0, e.offset - max_header))
+            block = f.read(e.offset - max(0, e.offset - max_header))
+        return block[block.rfind(b'>') + 1:].strip().decode()
+
+
 # Usage 
 if __name__ == "__main__":
     parser = FastaParser()
@@ -0,0 +1,77 @@
+# Content-addressed cache of rendered plots: one PNG per (dataset, plot type, parameters), oldest evicted once the folder outgrows its budget
+
+import hashlib
+import json
+import os
+import threading
+from metrics import inc, timer
+
+
+class PlotCache:
+    def __init__(self, folder: str, max_bytes: int = 256 << 20):
+        self._folder = folder
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._rendering = {}                                          # key -> lock held while that plot is being drawn
+        os.makedirs(folder, exist_ok=True)
+
+    @property
+    def folder(self):
+        return self._folder
+
+    @staticmethod
+    def key(*parts):
+        # Stable hex key for any JSON-serializable parts, e.g. (dataset hash, plot type, motifs)
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def filename(key):
+        return f"plot_{key}.png"
+
+    def path(self, key):
+        return os.path.join(self._folder, self.filename(key))
+
+    def get_or_render(self, key, render):
+        # Filename of the cached plot, calling render(path) first if it is not on disk yet
+        path = self.path(key)
+        with self._lock:
+            render_lock = self._rendering.setdefault(key, threading.Lock())
+        try:
+            with render_lock: # a second request for the same plot waits for the first instead of drawing it again
+                if os.path.exists(path):
+                    os.utime(path) # mtime doubles as last use for eviction
+                    inc("cache_hits_total", cache="plot")
+                else:
+                    inc("cache_misses_total", cache="plot")
+                    tmp_path = os.path.join(self._folder, f"tmp_{key}_{threading.get_ident()}.png")
+                    try:
+                        with timer("plot_render_seconds"):
+                            render(tmp_path)
+                        os.replace(tmp_path, path)
+                    finally:
+                        if os.path.exists(tmp_path): # render() failed, drop whatever it wrote
+                            os.remove(tmp_path)
+                    self._evict(keep=path)
+        finally:
+            # Releasing render_lock lets waiters in (they render again if this attempt failed)
+            with self._lock:
+                self._rendering.pop(key, None)
+        return self.filename(key)
+
+    def _evict(self, keep):
+        # Delete least recently used plots until the folder fits in max_bytes
+        entries = []
+        for entry in os.scandir(self._folder):
+            if entry.name.startswith("plot_") and entry.name.endswith(".png") and entry.path != keep:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+        for _, size, path in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+                inc("cache_evictions_total", cache="plot")
+            except FileNotFoundError:
+                pass
+            total -= size
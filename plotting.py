@@ -0,0 +1,13 @@
+# Deferred matplotlib import: pyplot costs about a second to load, so it is only imported when the first plot is drawn
+
+import sys
+
+
+def pyplot():
+    # pyplot with the non-interactive Agg backend pinned (plots are written to files, often from worker threads);
+    # a caller that already imported pyplot itself keeps its own backend
+    if "matplotlib.pyplot" not in sys.modules:
+        import matplotlib
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
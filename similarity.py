@@ -0,0 +1,137 @@
+# Pairwise genome similarity: alignments spread over a process pool, completed pairs cached for the lifetime of the dataset
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from models import SequenceAlignment
+from metrics import inc
+
+_worker_seqs = None                                                  # per-process copy of the sequences, set once by the pool initializer
+_worker_params = None
+# Workers start from a clean interpreter rather than a fork of the web process, whose threads may hold locks
+# (job pool, registry, logging) that a forked child would inherit locked; forkserver is not available on Windows
+_MP_CONTEXT = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _init_worker(seqs, params):
+    global _worker_seqs, _worker_params
+    _worker_seqs = seqs
+    _worker_params = params
+
+
+def _align_pair_of(seqs, params, pair):
+    i, j = pair
+    gap_pen, match, mismatch, algo = params
+    result = SequenceAlignment(seqs[i], seqs[j]).align(gap_pen, match, mismatch, algo)
+    return i, j, result.score, result.identity
+
+
+def _align_pair(pair):
+    return _align_pair_of(_worker_seqs, _worker_params, pair)
+
+
+class SimilarityEngine:
+    def __init__(self, genomes, algo="banded", gap_pen=-2, match=1, mismatch=-1, max_workers=None):
+        self._genomes = genomes
+        self._params = (gap_pen, match, mismatch, algo)
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._pairs = {}                                             # (i, j) with i < j -> (score, identity)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(i, j):
+        # Score and identity are taken from the alignment of the lower index against the higher, so both orders share one entry
+        return (i, j) if i < j else (j, i)
+
+    def cached_pairs(self):
+        return len(self._pairs)
+
+    @property
+    def nbytes(self):
+        # Rough size of the pair cache: key tuple, value tuple and four boxed numbers per entry
+        return len(self._pairs) * 300
+
+    def clear(self):
+        with self._lock:
+            self._pairs.clear()
+
+    def compute(self, pairs, progress=None):
+        # Align every pair not cached yet; progress(done, total) is called as results arrive
+        with self._lock:
+            requested = {self._key(i, j) for i, j in pairs if i != j}
+            missing = sorted(requested - self._pairs.keys())
+        total = len(missing)
+        inc("cache_hits_total", len(requested) - total, cache="similarity")
+        inc("cache_misses_total", total, cache="similarity")
+        if progress:
+            progress(0, total)
+        if not missing:
+            return
+        # Only the genomes these pairs touch are decoded and shipped to the workers, keyed by their index in the dataset
+        seqs = {i: self._genomes[i].seq for i in sorted({i for pair in missing for i in pair})}
+        if self._max_workers == 1 or total == 1:
+            results = (_align_pair_of(seqs, self._params, pair) for pair in missing)
+            self._collect(results, total, progress)
+            return
+        workers = min(self._max_workers, total)
+        chunksize = max(1, total // (workers * 4))
+        pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context(_MP_CONTEXT),
+            initializer=_init_worker, initargs=(seqs, self._params),
+        )
+        try:
+            self._collect(pool.map(_align_pair, missing, chunksize=chunksize), total, progress)
+        finally:
+            # If progress() raised (e.g. the job was cancelled) the queued pairs are dropped instead of awaited
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _collect(self, results, total, progress):
+        for done, (i, j, score, identity) in enumerate(results, start=1):
+            with self._lock:
+                self._pairs[(i, j)] = (score, identity)
+            if progress:
+                progress(done, total)
+
+    def pair(self, i, j):
+        self.compute([(i, j)])
+        return self._pairs[self._key(i, j)]
+
+    def rank_by_sketch(self, ref_idx):
+        # Every other genome as (index, estimated ANI %), most similar first, from MinHash sketches only
+        reference = self._genomes[ref_idx].sketch
+        ranked = [(i, reference.ani(g.sketch)) for i, g in enumerate(self._genomes) if i != ref_idx]
+        return sorted(ranked, key=lambda item: item[1], reverse=True)
+
+    def to_reference(self, ref_idx, progress=None, top_k=None):
+        # Same rows as the similarity page: other genomes against the reference.
+        # With top_k, only the top_k best sketch candidates get an exact alignment, in sketch order
+        if top_k is not None and top_k < 1:
+            raise ValueError(f"top_k must be at least 1, got {top_k}")
+        if top_k is None:
+            targets = [i for i in range(len(self._genomes)) if i != ref_idx]
+            estimates = {}
+        else:
+            ranked = self.rank_by_sketch(ref_idx)[:top_k]
+            targets = [i for i, _ in ranked]
+            estimates = dict(ranked)
+        self.compute([(ref_idx, i) for i in targets], progress)
+        results = []
+        for i in targets:
+            score, identity = self._pairs[self._key(ref_idx, i)]
+            results.append({"id": self._genomes[i].id, "score": score, "similarity": identity, "ani": estimates.get(i)})
+        return results
+
+    def matrix(self, progress=None):
+        # Full N x N score and identity matrices (diagonal left at 0)
+        n = len(self._genomes)
+        self.compute([(i, j) for i in range(n) for j in range(i + 1, n)], progress)
+        scores = np.zeros((n, n))
+        identity = np.zeros((n, n))
+        for (i, j), (score, ident) in self._pairs.items():
+            scores[i, j] = scores[j, i] = score
+            identity[i, j] = identity[j, i] = ident
+        return scores, identity
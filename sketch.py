@@ -0,0 +1,73 @@
+# k-mer MinHash (bottom-s) sketches for fast approximate genome similarity
+
+import math
+
+import numpy as np
+
+_CODES = np.full(256, 4, dtype=np.uint64)                             # 2-bit base codes, 4 marks any other character
+for _i, _base in enumerate("ACGT"):
+    _CODES[ord(_base)] = _i
+    _CODES[ord(_base.lower())] = _i
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _mix64(x):
+    # splitmix64 finalizer: spreads the packed k-mers uniformly over 64 bits (NumPy uint64 arithmetic wraps)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return (x ^ (x >> np.uint64(31))) & _MASK64
+
+
+def kmerHashes(seq, k):
+    # Hash of every k-mer made only of A/C/G/T, k <= 32 so a k-mer packs into one uint64
+    codes = _CODES[np.frombuffer(seq.encode("ascii"), dtype=np.uint8)]
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    bad = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid = bad[k:] == bad[:-k]                                       # window contains no ambiguous base
+    packed = np.zeros(n, dtype=np.uint64)
+    for p in range(k):
+        packed = (packed << np.uint64(2)) | (codes[p:p+n] & np.uint64(3))
+    with np.errstate(over="ignore"):
+        return _mix64(packed[valid])
+
+
+class MinHashSketch:
+    def __init__(self, seq: str, k: int = 21, size: int = 1000):
+        if not 0 < k <= 32:
+            raise ValueError("k must be between 1 and 32")
+        self._k = k
+        self._size = size
+        self._hashes = np.unique(kmerHashes(seq, k))[:size]          # the size smallest distinct hashes, sorted
+
+    @property
+    def k(self):
+        return self._k
+
+    @property
+    def hashes(self):
+        return self._hashes
+
+    def jaccard(self, other: "MinHashSketch"):
+        # Bottom-s estimate: the fraction of the s smallest hashes of the union that both sketches contain
+        if self._k != other._k:
+            raise ValueError("Sketches built with different k cannot be compared")
+        size = min(self._size, other._size)
+        merged = np.concatenate((self._hashes, other._hashes))
+        merged.sort()
+        if len(merged) == 0:
+            return 0.0
+        repeated = merged[1:] == merged[:-1]                          # each shared hash shows up twice in a row
+        union = merged[np.concatenate(([True], ~repeated))][:size]
+        shared = np.count_nonzero(merged[1:][repeated] <= union[-1])
+        return shared / len(union)
+
+    def ani(self, other: "MinHashSketch"):
+        # Mash estimate of average nucleotide identity (%) from the Jaccard index
+        j = self.jaccard(other)
+        if j <= 0:
+            return 0.0
+        distance = -math.log(2 * j / (1 + j)) / self._k
+        return max(0.0, 1 - distance) * 100
@@ -0,0 +1,38 @@
+# Suffix array construction by prefix doubling on integer arrays
+
+import numpy as np
+
+
+def suffixArray(T):
+    # T must end with a unique terminator (e.g. "$") so sorting suffixes gives the same order as sorting rotations
+    text = np.frombuffer(T.encode("ascii"), dtype=np.uint8)
+    n = len(text)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    rank = np.unique(text, return_inverse=True)[1].astype(np.int64)  # dense rank of each suffix by its first k characters
+    sa = np.argsort(rank, kind="stable")
+    k = 1
+    while True:
+        rank_max = int(rank.max())
+        if rank_max == n - 1:                                         # all ranks distinct => suffixes fully sorted
+            break
+        # Sort suffixes by the pair (rank[i], rank[i+k]), the second key is -1 past the end of T
+        second = np.full(n, -1, dtype=np.int64)
+        second[:n-k] = rank[k:]
+        key = rank * (rank_max + 2) + (second + 1)                   # both ranks packed into one integer, order preserving
+        sa = np.argsort(key, kind="stable")
+        sorted_key = key[sa]
+        # New rank = number of distinct keys before the suffix in sorted order
+        new_rank = np.empty(n, dtype=np.int64)
+        new_rank[sa] = np.concatenate(([0], np.cumsum(sorted_key[1:] != sorted_key[:-1])))
+        rank = new_rank
+        k *= 2
+        if k >= n:
+            break
+    return sa
+
+
+def bwtFromSuffixArray(T, sa):
+    # L[i] is the character preceding suffix sa[i]; for sa[i] = 0 the index -1 wraps around to the terminator
+    text = np.frombuffer(T.encode("ascii"), dtype=np.uint8)
+    return text[sa - 1].tobytes().decode("ascii")
@@ -0,0 +1,93 @@
+# The NumPy, Hirschberg and banded aligners checked against the pure-Python reference implementations
+
+import random
+
+import pytest
+
+import numpy_alignment
+from models import AlignmentResult, SequenceAlignment
+from numpy_alignment import bandedAlignment, globalAlignmentScore, hirschbergAlignment, localAlignmentScore
+
+PARAMS = [(-2, 1, -1), (-1, 2, -1), (-3, 1, -2)]                     # (gap_pen, match, mismatch)
+EMPTY_PAIRS = [("", ""), ("", "ACGT"), ("GATTACA", ""), ("A", "A"), ("A", "C")]
+
+
+def random_pairs(seed, count=40, max_length=40):
+    # Related pairs (one mutated from the other) and unrelated ones, lengths from 0
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        a = "".join(rng.choice("ACGT") for _ in range(rng.randint(0, max_length)))
+        if rng.random() < 0.5:
+            b = "".join(rng.choice("ACGT") for _ in range(rng.randint(0, max_length)))
+        else:
+            b = "".join(c if rng.random() > 0.2 else rng.choice(["", "A", c + "T"]) for c in a)
+        pairs.append((a, b))
+    return pairs
+
+
+def rescore(seq1_gapped, seq2_gapped, gap_pen, match, mismatch):
+    # Score of a global alignment given as two gapped strings
+    score = 0
+    for a, b in zip(seq1_gapped, seq2_gapped):
+        if a == "-" or b == "-":
+            score += gap_pen
+        else:
+            score += match if a == b else mismatch
+    return score
+
+
+def check_global(result, reference, A, B, params):
+    # Same optimal score, and the alignment spells out both sequences and really scores that much
+    assert result.score == reference.score
+    assert result.seq1_gapped.replace("-", "") == A
+    assert result.seq2_gapped.replace("-", "") == B
+    assert rescore(result.seq1_gapped, result.seq2_gapped, *params) == reference.score
+
+
+@pytest.mark.parametrize("params", PARAMS)
+@pytest.mark.parametrize("algo", ["global_numpy", "hirschberg", "banded"])
+def test_global_engines_match_reference(algo, params):
+    for A, B in EMPTY_PAIRS + random_pairs(seed=1):
+        reference = SequenceAlignment(A, B).align(*params, "global")
+        result = SequenceAlignment(A, B).align(*params, algo)
+        check_global(result, reference, A, B, params)
+        assert result.identity == pytest.approx(reference.identity), (A, B)
+        assert globalAlignmentScore(A, B, *params) == reference.score
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_local_numpy_matches_reference(params):
+    for A, B in EMPTY_PAIRS + random_pairs(seed=3):
+        reference = SequenceAlignment(A, B).align(*params, "local")
+        result = SequenceAlignment(A, B).align(*params, "local_numpy")
+        assert result.score == reference.score, (A, B)
+        assert result.identity == pytest.approx(reference.identity), (A, B)
+        assert localAlignmentScore(A, B, *params) == reference.score
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_hirschberg_recursion_matches_reference(params, monkeypatch):
+    # Short pairs normally go straight to the full matrix; a tiny cutoff makes them split down to single rows.
+    # Co-optimal alignments may differ from the full traceback, so identity is not compared here
+    monkeypatch.setattr(numpy_alignment, "FULL_DP_CELLS", 4)
+    for A, B in EMPTY_PAIRS + random_pairs(seed=4):
+        reference = SequenceAlignment(A, B).align(*params, "global")
+        alignment, score = hirschbergAlignment(A, B, *params)
+        check_global(AlignmentResult(*alignment, score), reference, A, B, params)
+
+
+@pytest.mark.parametrize("params", PARAMS)
+@pytest.mark.parametrize("band", [0, 1, 2])
+def test_narrow_band_matches_reference(band, params):
+    # Bands narrower than the length difference, and pairs whose optimal path leaves the starting band
+    rng = random.Random(band)
+    pairs = [("ACGT", "ACGTACGTACGTACGTACGT"), ("TTTTTTTTTTTTTTTTTTGA", "GA"), ("", "ACGTACGT")]
+    pairs += [(a, a[len(a) // 2:] + a[:len(a) // 2]) for a, _ in random_pairs(seed=5, count=10)]
+    pairs += [(a, "".join(rng.choice("ACGT") for _ in range(len(a) + 15))) for a, _ in random_pairs(seed=6, count=10)]
+    for A, B in pairs:
+        reference = SequenceAlignment(A, B).align(*params, "global")
+        alignment, score = bandedAlignment(A, B, *params, band=band)
+        result = AlignmentResult(*alignment, score)
+        check_global(result, reference, A, B, params)
+        assert result.identity == pytest.approx(reference.identity), (A, B)
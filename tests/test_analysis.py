@@ -0,0 +1,60 @@
+# MitoAnalysisSystem motif queries checked against the per-genome reference computations they replaced
+
+import random
+
+import pytest
+
+from analysis import MitoAnalysisSystem
+from models import SequenceAlignment
+
+
+@pytest.fixture(scope="module")
+def system(tmp_path_factory):
+    rng = random.Random(0)
+    path = tmp_path_factory.mktemp("data") / "genomes.fasta"
+    with open(path, "w") as f:
+        for i in range(12):
+            seq = "".join(rng.choice("ACGT") for _ in range(300))
+            if i % 3 == 0:
+                seq = seq[:100] + "GATCAGGTACCA" + seq[112:]             # planted in some genomes only
+            f.write(f">g{i}\n{seq}\n")
+    return MitoAnalysisSystem(str(path), persist_index=False)
+
+
+def old_conservation(system, motif, threshold_score=4):
+    # The rule the heatmap used before the FM-index: local alignment score (match 1, mismatch -1, gap -2) of at least the threshold
+    return [1 if SequenceAlignment(motif, g.seq).get_alignment_scores(algo="local") >= threshold_score else 0 for g in system.genomes]
+
+
+def test_short_motifs_are_never_conserved(system):
+    assert system.motif_conservation_matrix(["GAT", "A"]) == [[0] * 12, [0] * 12]
+    assert old_conservation(system, "GAT") == [0] * 12
+
+
+@pytest.mark.parametrize("motif", ["GATC", "TATA", "ACGT", "GGTA"])
+def test_threshold_length_motifs_match_the_old_rule(system, motif):
+    # A motif as long as the threshold only reaches it with an exact hit, under both rules
+    assert system.motif_conservation_matrix([motif])[0] == old_conservation(system, motif)
+
+
+@pytest.mark.parametrize("motif", ["GATCA", "GATCAGGTACCA", "GATCAGCTACCA", "TTGACCGTAAGT"])
+@pytest.mark.parametrize("max_diffs", [0, 1, 2])
+def test_longer_motifs_stay_within_the_old_rule(system, motif, max_diffs):
+    # Every genome conserved now scored at least the threshold before; partial hits that only the old score counted are gone
+    new = system.motif_conservation_matrix([motif], max_diffs=max_diffs)[0]
+    old = old_conservation(system, motif)
+    assert all(o >= n for n, o in zip(new, old))
+
+
+def test_planted_motif_is_found(system):
+    assert system.motif_conservation_matrix(["GATCAGGTACCA"], max_diffs=0)[0][::3] == [1] * 4
+    assert system.motif_conservation_matrix(["GATCAGCTACCA"], max_diffs=1)[0][::3] == [1] * 4
+
+
+@pytest.mark.parametrize("max_diffs", [0, 1])
+def test_ambiguous_motifs_match_their_expansions(system, max_diffs):
+    # An IUPAC motif is conserved wherever one of its concrete variants is
+    variants = system.motif_conservation_matrix(["GATCAGGTACCA", "GATCAGGTACCT"], max_diffs=max_diffs)
+    expected = [max(a, b) for a, b in zip(*variants)]
+    assert system.motif_conservation_matrix(["GATCAGGTACCW"], max_diffs=max_diffs)[0] == expected
+    assert sum(system.motif_conservation_matrix(["GANTC"], max_diffs=max_diffs)[0]) > 0
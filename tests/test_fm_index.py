@@ -0,0 +1,132 @@
+# Suffix array, FM-index and approximate search checked against brute-force oracles on random texts
+
+import random
+
+import pytest
+
+from fm_index_query import FMIndex, CollectionFMIndex
+from suffix_array import suffixArray
+
+
+def random_text(rng, length, alphabet="ACGT"):
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def naive_suffix_array(T):
+    return sorted(range(len(T)), key=lambda i: T[i:])
+
+
+def occurrences(T, P):
+    # Every offset of P in T, overlapping hits included
+    hits = []
+    i = T.find(P)
+    while i != -1:
+        hits.append(i)
+        i = T.find(P, i + 1)
+    return hits
+
+
+def hamming_hits(T, P, max_diffs):
+    hits = []
+    for i in range(len(T) - len(P) + 1):
+        diffs = sum(a != b for a, b in zip(T[i:i + len(P)], P))
+        if diffs <= max_diffs:
+            hits.append((i, diffs))
+    return hits
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_suffix_array_matches_sorted_suffixes(seed):
+    rng = random.Random(seed)
+    T = random_text(rng, rng.randint(1, 300), rng.choice(["A", "AC", "ACGT"])) + "$"
+    assert suffixArray(T).tolist() == naive_suffix_array(T)
+
+
+def test_suffix_array_edge_cases():
+    assert suffixArray("").tolist() == []
+    assert suffixArray("$").tolist() == [0]
+    T = "A" * 64 + "$"                                                # longest doubling run: every prefix rank ties
+    assert suffixArray(T).tolist() == naive_suffix_array(T)
+
+
+def check_queries(index, T, patterns):
+    for P in patterns:
+        expected = occurrences(T, P)
+        assert index.count(P) == len(expected), P
+        assert sorted(index.locate(P)) == expected, P
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_count_and_locate_match_str_find(seed, tmp_path):
+    rng = random.Random(seed)
+    T = random_text(rng, rng.randint(50, 2000))
+    # Patterns taken from the text (at least one hit) plus random ones (often none)
+    patterns = []
+    for _ in range(30):
+        start = rng.randrange(len(T))
+        patterns.append(T[start:start + rng.randint(1, 12)])
+        patterns.append(random_text(rng, rng.randint(1, 8)))
+    # Small checkpoint and sample rates so rank and locate cross many checkpoints and sampled rows
+    index = FMIndex(T, checkpoint_interval=rng.choice([1, 4, 64]), sa_sample_rate=rng.choice([1, 3, 32]))
+    check_queries(index, T, patterns)
+    assert index.count("") == 0
+    assert index.count("N") == 0
+    index.save(str(tmp_path / "index"))
+    check_queries(FMIndex.load(str(tmp_path / "index")), T, patterns)
+
+
+def test_load_or_build_reuses_saved_index(tmp_path):
+    T = random_text(random.Random(1), 500)
+    path = str(tmp_path / "index")
+    FMIndex.load_or_build(path, T)
+    loaded = FMIndex.load_or_build(path, "unused, the saved index is opened instead")
+    check_queries(loaded, T, ["ACG", "T", "GATC", T[100:120]])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_approximate_search_matches_hamming_scan(seed):
+    rng = random.Random(seed)
+    T = random_text(rng, rng.randint(100, 400))
+    index = FMIndex(T)
+    for _ in range(10):
+        start = rng.randrange(len(T) - 10)
+        P = T[start:start + rng.randint(4, 10)]
+        max_diffs = rng.randint(0, 2)
+        assert index.approximate_search(P, max_diffs) == hamming_hits(T, P, max_diffs), (P, max_diffs)
+
+
+def test_collection_index_maps_hits_to_genomes():
+    rng = random.Random(7)
+    seqs = [random_text(rng, rng.randint(50, 400)) for _ in range(5)]
+    ids = [f"g{i}" for i in range(len(seqs))]
+    index = CollectionFMIndex(ids, seqs, checkpoint_interval=8, sa_sample_rate=4)
+    for P in ["A", "GA", "TAC", "GATC", seqs[2][10:20]]:
+        assert index.count_per_genome(P) == [len(occurrences(seq, P)) for seq in seqs]
+        result = index.query(P)
+        for genome_id, seq in zip(ids, seqs):
+            count, offsets = result[genome_id]
+            assert count == len(occurrences(seq, P))
+            assert list(offsets) == occurrences(seq, P)
+
+
+def iupac_hits(T, P, max_diffs):
+    # Hamming scan where an IUPAC code matches any of its bases
+    from aho_corasick import IUPAC
+    hits = []
+    for i in range(len(T) - len(P) + 1):
+        diffs = sum(a not in IUPAC[b] for a, b in zip(T[i:i + len(P)], P))
+        if diffs <= max_diffs:
+            hits.append((i, diffs))
+    return hits
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_approximate_search_with_iupac_codes(seed):
+    rng = random.Random(seed)
+    T = random_text(rng, rng.randint(100, 400))
+    index = FMIndex(T)
+    for _ in range(10):
+        start = rng.randrange(len(T) - 10)
+        P = "".join(c if rng.random() > 0.3 else rng.choice("NRYWS") for c in T[start:start + rng.randint(4, 8)])
+        max_diffs = rng.randint(0, 1)
+        assert index.approximate_search(P, max_diffs) == iupac_hits(T, P, max_diffs), (P, max_diffs)
@@ -0,0 +1,77 @@
+# PackedSequence checked against the plain string it was packed from
+
+import random
+
+import pytest
+
+from packed_sequence import PackedSequence
+
+
+def composition(seq):
+    # What MitochondrialDNA.get_composition reports for an unpacked sequence
+    counts = {base: seq.count(base) for base in "ACGT"}
+    counts["other"] = len(seq) - sum(counts.values())
+    return counts
+
+
+def random_sequence(rng, length):
+    # Mostly bases, with N runs, other IUPAC codes and soft-masked (lowercase) stretches
+    chunks = []
+    while sum(map(len, chunks)) < length:
+        kind = rng.random()
+        if kind < 0.1:
+            chunks.append(rng.choice("NRYn") * rng.randint(1, 20))
+        elif kind < 0.3:
+            chunks.append("".join(rng.choice("acgtn") for _ in range(rng.randint(1, 40))))
+        else:
+            chunks.append("".join(rng.choice("ACGT") for _ in range(rng.randint(1, 60))))
+    return "".join(chunks)[:length]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_round_trip_slices_and_composition(seed):
+    rng = random.Random(seed)
+    seq = random_sequence(rng, rng.randint(0, 600))
+    packed = PackedSequence.from_string(seq)
+    assert len(packed) == len(seq)
+    assert str(packed) == seq
+    assert packed.composition() == composition(seq)
+    assert packed.gc_count() == seq.count("G") + seq.count("C")
+    for _ in range(20):
+        start = rng.randint(0, len(seq))
+        stop = rng.randint(start, len(seq))
+        view = packed[start:stop]
+        assert str(view) == seq[start:stop]
+        assert view.composition() == composition(seq[start:stop])
+        # Slices of slices keep pointing into the original buffer
+        inner = rng.randint(0, stop - start)
+        assert str(view[inner:]) == seq[start + inner:stop]
+    if seq:
+        assert packed[0] == seq[0]
+        assert packed[-1] == seq[-1]
+
+
+def test_exceptions_are_stored_as_runs():
+    seq = "ACGT" + "N" * 1000 + "ACGT" + "R" + "acgtacgt" + "nnnn"
+    packed = PackedSequence.from_string(seq)
+    assert str(packed) == seq
+    assert composition(seq) == packed.composition()
+    assert str(packed[3:6]) == "TNN"
+    assert str(packed[1005:1020]) == seq[1005:1020]
+
+
+def test_soft_masked_sequence_stays_small():
+    rng = random.Random(0)
+    seq = "".join(rng.choice("acgt") for _ in range(16569))
+    packed = PackedSequence.from_string(seq)
+    assert str(packed) == seq
+    assert packed.nbytes < len(seq) // 2
+
+
+def test_index_errors():
+    packed = PackedSequence.from_string("ACGT")
+    with pytest.raises(IndexError):
+        packed[4]
+    with pytest.raises(ValueError):
+        packed[::2]
+    assert str(packed[10:20]) == ""
@@ -0,0 +1,84 @@
+# FastaParser.stream and the .fai offset index, checked against the sequences written to small FASTA files
+
+import random
+
+import pytest
+
+from parser import FastaIndex, FastaParser
+
+
+def write(tmp_path, text, name="genomes.fasta"):
+    path = tmp_path / name
+    path.write_bytes(text.encode())
+    return str(path)
+
+
+def wrapped(records, width, newline="\n"):
+    lines = []
+    for name, seq in records:
+        lines.append(f">{name} description of {name}")
+        lines.extend(seq[i:i + width] for i in range(0, len(seq), width))
+    return newline.join(lines) + newline
+
+
+@pytest.fixture
+def records():
+    rng = random.Random(0)
+    return [(f"s{i}", "".join(rng.choice("ACGTN") for _ in range(rng.randint(1, 250)))) for i in range(6)]
+
+
+@pytest.mark.parametrize("width", [1, 7, 60, 1000])
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_stream_and_index_read_back_every_record(tmp_path, records, width, newline):
+    path = write(tmp_path, wrapped(records, width, newline))
+    streamed = list(FastaParser().stream(path))
+    assert [(r.id, r.seq) for r in streamed] == records
+    assert streamed[0].description == "s0 description of s0"
+    index = FastaIndex(path)
+    assert index.names() == [name for name, _ in records]
+    rng = random.Random(width)
+    for name, seq in records:
+        assert index.length(name) == len(seq)
+        assert index.fetch(name) == seq
+        assert index.description(name) == f"{name} description of {name}"
+        start = rng.randint(0, len(seq))
+        end = rng.randint(start, len(seq))
+        assert index.fetch(name, start, end) == seq[start:end]
+
+
+def test_index_is_reused_from_disk(tmp_path, records):
+    path = write(tmp_path, wrapped(records, 50))
+    FastaIndex(path)
+    reopened = FastaIndex(path)
+    assert [reopened.fetch(name) for name, _ in records] == [seq for _, seq in records]
+
+
+def test_last_line_without_newline_and_trailing_blank_lines(tmp_path):
+    path = write(tmp_path, ">a\nACGT\nAC\n\n>b\nAAAA\nA")
+    index = FastaIndex(path)
+    assert index.fetch("a") == "ACGTAC"
+    assert index.fetch("b") == "AAAAA"
+    assert [r.seq for r in FastaParser().stream(path)] == ["ACGTAC", "AAAAA"]
+
+
+@pytest.mark.parametrize("text", [
+    ">s1\nAC\nACGT\n>s2\nACGT\n",                                     # a line longer than the first one
+    ">s1\nACGT\nAC\nACGT\n",                                          # sequence after a short line
+    ">s1\nACGTACGTAC\n\nTTTTTTTTTT\n",                                # sequence after a blank line
+    ">s1\nACGT\r\nACGT\nAC\n",                                        # line endings change inside a record
+    ">s1\nACGT\n>s1\nACGT\n",                                         # duplicate name
+])
+def test_index_rejects_files_it_cannot_offset(tmp_path, text):
+    path = write(tmp_path, text)
+    with pytest.raises(ValueError):
+        FastaIndex(path)
+    # The streaming parser has no offsets to get wrong and still reads them
+    assert list(FastaParser().stream(path))
+
+
+def test_missing_and_empty_files(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        FastaIndex(str(tmp_path / "missing.fasta"))
+    with pytest.raises(ValueError):
+        FastaIndex(write(tmp_path, "no header here\n"))
+    assert list(FastaParser().stream(write(tmp_path, "", "empty.fasta"))) == []